@@ -0,0 +1,53 @@
+"""Compare the legacy two-pass camelot extraction with the shared single-parse engine.
+
+Usage (from the repository root):
+    python -m Benchmarks.benchmark_extraction Documents/NewlyUploaded/*.pdf
+"""
+import sys
+import time
+import camelot
+from file_processing import parse_pdf_tables, stream_table_areas
+
+
+# Legacy behaviour: one full camelot pass per flavor
+def parse_twice(file_path):
+    stream_tables = camelot.read_pdf(file_path, flavor='stream', pages='1-end', table_areas=stream_table_areas)
+    lattice_tables = camelot.read_pdf(file_path, flavor='lattice', pages='1-end')
+    return stream_tables, lattice_tables
+
+
+def same_tables(left, right):
+    return len(left) == len(right) and all(a.df.equals(b.df) for a, b in zip(left, right))
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main(file_paths):
+    total_legacy = total_single = 0.0
+
+    print(f"{'document':40} {'two-pass (s)':>12} {'single (s)':>12} {'saving':>8}  identical")
+    for file_path in file_paths:
+        legacy_time, (legacy_stream, legacy_lattice) = time_call(parse_twice, file_path)
+        single_time, (stream, lattice, lattice_error) = time_call(parse_pdf_tables, file_path)
+        if lattice_error is not None:
+            print(f"[WARNING] Lattice failed for {file_path}: {lattice_error}")
+
+        identical = same_tables(legacy_stream, stream) and same_tables(legacy_lattice, lattice)
+        saving = 1 - single_time / legacy_time if legacy_time else 0.0
+        print(f"{file_path[-40:]:40} {legacy_time:12.2f} {single_time:12.2f} {saving:8.1%}  {identical}")
+
+        total_legacy += legacy_time
+        total_single += single_time
+
+    if file_paths and total_legacy:
+        print(f"Total: {total_legacy:.2f}s -> {total_single:.2f}s "
+              f"({1 - total_single / total_legacy:.1%} saved, "
+              f"{(total_legacy - total_single) / len(file_paths):.2f}s per document)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,194 @@
+"""End-to-end benchmark on a synthetic proposal corpus, saved as a JSON baseline for run to run comparisons.
+
+Times extract_data, extract_lattice_section, extract_docx_text, split_text_by_parts and generate_prompt per
+document size, and full generate_grades runs (cold and warm extraction cache) against a local stub LLM.
+Everything runs in a temporary folder; the repository's Documents folder is not touched.
+
+Usage (from the repository root):
+    python -m Benchmarks.benchmark_suite [--sizes 2 10 50 120] [--repeat 3] [--llm-latency 0.0]
+                                         [--save Benchmarks/Results/run.json] [--compare baseline.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import warnings
+import tempfile
+import contextlib
+import camelot
+import fitz
+import main
+import llm_processing
+import file_processing
+from Helper.llm_pool import use_endpoints
+from Helper.llm_router import Endpoint
+from Helper.ollama_stub import OllamaStub
+from Benchmarks.synthetic_proposals import write_corpus
+
+
+repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Best of several runs (the first result is returned for checks); output of the call is kept quiet
+def time_runs(func, *args, repeat=1):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = func(*args)
+            runs.append(time.perf_counter() - start)
+        if result is None:
+            result = value
+    return {"seconds": min(runs), "runs": runs}, result
+
+
+def document_timings(file_paths, rubric, repeat):
+    timings = {}
+    errors = {}
+
+    for file_path in file_paths:
+        name = os.path.splitext(os.path.basename(file_path))[0].replace("proposal_", "")
+        extension = os.path.splitext(file_path)[1]
+
+        if extension == ".pdf":
+            # Cold parse every run. The lattice tables are parsed along with the stream tables inside
+            # extract_data, so the lattice share of each parse is reported on its own
+            lattice_runs = []
+
+            def extract_stream(path):
+                file_processing.release_parsed_pdf(path)
+                text = file_processing.extract_data(path)
+                lattice_runs.append(file_processing.pdf_parse_seconds[os.path.abspath(path)]["lattice"])
+                return text
+
+            timings[f"extract_data/{name}"], text = time_runs(extract_stream, file_path, repeat=repeat)
+            timings[f"lattice_tables/{name}"] = {"seconds": min(lattice_runs), "runs": lattice_runs}
+            with contextlib.redirect_stdout(io.StringIO()):
+                lattice = file_processing.extract_lattice_section(file_path)
+            if lattice is None:
+                errors[f"extract_lattice_section/{name}"] = "lattice extraction failed (is Ghostscript installed?)"
+        else:
+            timings[f"extract_docx_text/{name}"], text = time_runs(file_processing.extract_docx_text, file_path,
+                                                                   repeat=repeat)
+
+        timings[f"split_text_by_parts/{name}.{extension[1:]}"], parts = time_runs(
+            llm_processing.split_text_by_parts, text, repeat=repeat)
+
+        def render_prompts(parts):
+            return [llm_processing.generate_prompt(rubric, part_name, question, part_text)
+                    for part_name, part_text in parts.items()
+                    for question in (rubric["sections"].get(part_name) or {}).get("criteria", []) or []]
+
+        timings[f"generate_prompt/{name}.{extension[1:]}"], _ = time_runs(render_prompts, parts, repeat=repeat)
+
+    return timings, errors
+
+
+def grading_timings(file_paths, llm_latency, repeat):
+    for file_path in file_paths:
+        shutil.copy(file_path, os.path.join("Documents", "NewlyUploaded"))
+
+    stub = OllamaStub(latency=llm_latency, distribution="fixed").start()
+    use_endpoints([Endpoint(stub.url)])
+    llm_processing.llm_cache_enabled = main.llm_cache_enabled = False
+
+    timings = {}
+    timings["generate_grades/cold"], _ = time_runs(main.generate_grades)
+    timings["generate_grades/warm"], _ = time_runs(main.generate_grades, repeat=repeat)
+    stub.stop()
+
+    with open(os.path.join("Documents", "Results", "Result.csv"), "r", encoding="utf-8") as file:
+        rows = sum(1 for _ in file) - 1
+    return timings, {"llm_requests": stub.requests, "result_rows": rows}
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    regressions = 0
+    print(f"\nCompared with {baseline_path} ({baseline.get('created', '?')}):")
+    print(f"{'step':48} {'baseline (s)':>12} {'now (s)':>10} {'ratio':>7}")
+    for key, timing in results["timings"].items():
+        before = baseline.get("timings", {}).get(key)
+        if before is None:
+            continue
+        ratio = timing["seconds"] / before["seconds"] if before["seconds"] else 1.0
+        slower = ratio > 1 + tolerance and timing["seconds"] - before["seconds"] > 0.01
+        regressions += slower
+        print(f"{key:48} {before['seconds']:12.4f} {timing['seconds']:10.4f} {ratio:7.2f}"
+              f"{'  REGRESSION' if slower else ''}")
+    print(f"{regressions} steps more than {tolerance:.0%} slower")
+    return regressions
+
+
+def main_benchmark(args):
+    parser = argparse.ArgumentParser(description="Benchmark the grading pipeline on synthetic proposals")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 10, 50, 120], help="pages per proposal")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per step (the best one is kept)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub LLM answer time in seconds")
+    parser.add_argument("--skip-grades", action="store_true", help="only time the single steps")
+    parser.add_argument("--save", help="result file (default Benchmarks/Results/benchmark_<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown reported as a regression")
+    options = parser.parse_args(args)
+
+    warnings.filterwarnings("ignore", message="No tables found")
+    created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    save_path = os.path.abspath(options.save or os.path.join(
+        repository_root, "Benchmarks", "Results", f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    compare_path = os.path.abspath(options.compare) if options.compare else None
+
+    results = {
+        "created": created,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "camelot": camelot.__version__, "pymupdf": fitz.VersionBind,
+                        "extractor_backend": file_processing.extractor_backend,
+                        "docx_reader": file_processing.docx_reader, "rubric": llm_processing.rubric_file},
+        "settings": {"sizes": options.sizes, "repeat": options.repeat, "llm_latency": options.llm_latency},
+        "timings": {},
+        "errors": {},
+    }
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            shutil.copytree(os.path.join(repository_root, "Prompts"), "Prompts")
+            file_processing.check_directory()
+            file_paths = write_corpus(os.path.join(workdir, "Corpus"), options.sizes)
+            rubric = llm_processing.get_compiled_rubric().rubric
+
+            timings, errors = document_timings(file_paths, rubric, options.repeat)
+            results["timings"].update(timings)
+            results["errors"].update(errors)
+
+            if not options.skip_grades:
+                timings, counts = grading_timings(file_paths, options.llm_latency, options.repeat)
+                results["timings"].update(timings)
+                results["grading"] = counts
+        finally:
+            os.chdir(working_directory)
+
+    print(f"{'step':48} {'best (s)':>10}")
+    for key, timing in results["timings"].items():
+        print(f"{key:48} {timing['seconds']:10.4f}")
+    for key, error in results["errors"].items():
+        print(f"[WARNING] {key}: {error}")
+
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {save_path}")
+
+    if compare_path:
+        compare(results, compare_path, options.tolerance)
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1:])
@@ -0,0 +1,86 @@
+"""Regression corpus and timing for the stream table formatter of extract_data.
+
+Every table of the corpus is formatted with the previous row by row formatter and with
+file_processing.format_table_rows; the outputs must be byte identical.
+
+Usage (from the repository root):
+    python -m Benchmarks.benchmark_table_formatter [rows_of_the_long_table]
+"""
+import sys
+import time
+import pandas as pd
+from file_processing import format_table_rows, title_matcher
+
+
+# Previous extract_data loop (iterrows, per-cell apply and string concatenation)
+def legacy_format(tables):
+    formatted_data = ""
+    for df in tables:
+        max_col_widths = [max(df[col].apply(lambda x: len(str(x))) + [len(str(col))]) for col in df.columns]
+        for _, row in df.iterrows():
+            row_cells = []
+            for idx, cell in enumerate(row):
+                cell_content = str(cell).strip()
+                if '\n' in cell_content or any(cell_content.strip().startswith(str(i) + ".") for i in range(1, 10)):
+                    for sub_item in cell_content.split('\n'):
+                        if any(sub_item.strip().startswith(str(i) + ".") for i in range(1, 10)):
+                            row_cells.append(sub_item.strip().replace(".", ". ", 1))
+                        else:
+                            row_cells.append(sub_item.ljust(max_col_widths[idx] + 2))
+                else:
+                    row_cells.append(cell_content.ljust(max_col_widths[idx] + 2))
+            row_str = "".join(row_cells).rstrip()
+            if title_matcher.search(row_str):
+                formatted_data += "\n\n"
+            formatted_data += row_str + "\n"
+        formatted_data += "\n\n"
+    return formatted_data
+
+
+# Current formatter, assembled the same way extract_data does
+def vectorized_format(tables):
+    parts = []
+    for df in tables:
+        for row_str in format_table_rows(df):
+            if title_matcher.search(row_str):
+                parts.append("\n\n")
+            parts.append(row_str + "\n")
+        parts.append("\n\n")
+    return "".join(parts)
+
+
+# Tables shaped like camelot stream output, covering the formatter's special cases
+def build_corpus(long_rows):
+    cells = [
+        "", "  padded cell  ", "Project Description / Purpose", "P r o j e c t  S c o p e:", "Timeline -",
+        "1.First numbered item", "9.Last digit", "10.Not a sub item", "0.Not numbered", " 3.Indented number",
+        "line one\nline two", "1.Numbered\nplain follow up\n2.Second", "trailing newline\n", "\n", "tab\there",
+        "● bullet text", "Ünïcödé – dash", "x" * 120,
+    ]
+    corpus = [
+        pd.DataFrame([["Only cell"]]),
+        pd.DataFrame([[cell] for cell in cells]),
+        pd.DataFrame([cells[i:i + 3] for i in range(0, len(cells) - 2)]),
+        pd.DataFrame([[cells[(r + c) % len(cells)] for c in range(12)] for r in range(30)]),
+    ]
+    corpus.append(pd.DataFrame([[cells[(r * 7 + c) % len(cells)] for c in range(4)] for r in range(long_rows)]))
+    return corpus
+
+
+def main(long_rows):
+    corpus = build_corpus(long_rows)
+
+    for i, df in enumerate(corpus):
+        if legacy_format([df]) != vectorized_format([df]):
+            print(f"[ERROR] Output differs for corpus table {i} ({df.shape[0]}x{df.shape[1]})")
+            sys.exit(1)
+    print(f"Corpus of {len(corpus)} tables: outputs are byte identical")
+
+    for name, func in [("legacy", legacy_format), ("vectorized", vectorized_format)]:
+        start = time.perf_counter()
+        func(corpus)
+        print(f"{name:10} {time.perf_counter() - start:8.3f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,86 @@
+"""Per-line cost of the part title matching: per-title regexes vs. the precompiled TitleMatcher.
+
+Usage (from the repository root):
+    python -m Benchmarks.benchmark_title_matching [number_of_lines]
+"""
+import re
+import sys
+import time
+from file_processing import title_matcher, title_normalizer
+from llm_processing import part_titles, section_title_matcher, description_title
+
+
+# Previous file_processing.match_title_with_variations: one pattern built per row and title
+def legacy_stream_match(line, title):
+    regex_title = r'[\s]*'.join(re.escape(char) for char in title if char != " ")
+    return re.search(fr"{regex_title}[\s:–-]*$", line, flags=re.IGNORECASE)
+
+
+# Previous nested matcher of llm_processing.split_text_by_parts
+def legacy_section_match(line, title):
+    regex_title = r'\s+'.join(re.escape(word) for word in title.split())
+    return re.search(fr"{regex_title}[\s:]*$", line, flags=re.IGNORECASE)
+
+
+# Previous clean_tabs_and_titles: one pattern compiled per title on every call
+def legacy_normalize(text):
+    for title in part_titles:
+        compressed_title = re.sub(r'\s+', '', title)
+        pattern = re.compile(r'(\s*)'.join(list(compressed_title)), re.IGNORECASE)
+        text = pattern.sub(title, text)
+    return text
+
+
+# A long proposal: titles (some spaced out or in another case) between paragraphs of body text
+def build_document(line_count):
+    body = "The clinic will screen every client for social needs and refer them to partners within 30 days."
+    variants = [lambda t: t, str.upper, lambda t: " ".join(t), lambda t: f"{t}:", lambda t: f"{t} -"]
+    lines = []
+    for i in range(line_count):
+        if i % 25 == 0:
+            title = part_titles[(i // 25) % len(part_titles)]
+            lines.append(variants[(i // 25) % len(variants)](title))
+        else:
+            lines.append(body)
+    return lines
+
+
+def time_lines(lines, func):
+    start = time.perf_counter()
+    results = [func(line) for line in lines]
+    return (time.perf_counter() - start) / len(lines), results
+
+
+def main(line_count):
+    lines = build_document(line_count)
+    other_titles = [title for title in part_titles if title != description_title]
+
+    checks = [
+        ("extract_data row match",
+         lambda line: any(legacy_stream_match(line, title) for title in part_titles),
+         lambda line: title_matcher.search(line) is not None),
+        ("split_text_by_parts match",
+         lambda line: next((title for title in other_titles if legacy_section_match(line, title)), None),
+         section_title_matcher.search),
+    ]
+
+    print(f"{line_count} lines, {len(part_titles)} titles")
+    for name, legacy, engine in checks:
+        legacy_cost, legacy_results = time_lines(lines, legacy)
+        engine_cost, engine_results = time_lines(lines, engine)
+        print(f"{name:28} {legacy_cost * 1e6:8.2f} us/line -> {engine_cost * 1e6:6.2f} us/line "
+              f"({legacy_cost / engine_cost:5.1f}x)  identical={legacy_results == engine_results}")
+
+    text = "\n".join(lines)
+    start = time.perf_counter()
+    legacy_text = legacy_normalize(text)
+    legacy_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    engine_text = title_normalizer.normalize(text)
+    engine_cost = time.perf_counter() - start
+    print(f"{'clean_tabs_and_titles':28} {legacy_cost * 1e3:8.2f} ms/doc  -> {engine_cost * 1e3:6.2f} ms/doc  "
+          f"({legacy_cost / engine_cost:5.1f}x)  identical={legacy_text == engine_text}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
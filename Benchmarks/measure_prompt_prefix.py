@@ -0,0 +1,68 @@
+"""Shared-prefix ratio of the prompts of a rubric run, for the classic and prefix prompt layouts.
+
+Every request is rendered as the chat model receives it (question answering chain prompt with the
+section text as context) in the order the criteria are asked. The part of a request that starts with
+the same text as the request before it can be served from the model server's prompt cache.
+
+Usage (from the repository root):
+    python -m Benchmarks.measure_prompt_prefix [--rubric Prompts/Rubric.yaml] [extracted_text.txt ...]
+
+Without text files, a generated proposal is used. Texts written to Documents/AlreadyRead
+(DEBUG_ARTIFACTS=1) are a good input.
+"""
+import os
+import sys
+from Helper.llm_pool import get_chain
+from llm_processing import CompiledRubric, find_sections, section_input_text, estimate_tokens, \
+    part_titles, rubric_file, llm_model
+
+
+def build_document():
+    body = "The clinic will screen every client for social needs and refer them to partners within 30 days. "
+    return "\n".join(f"{title}\n{body * 6}" for title in part_titles)
+
+
+# Requests of a rubric run over the documents, in the order they are sent
+def rubric_requests(rubric: CompiledRubric, texts: list):
+    chat_prompt = get_chain(llm_model, temperature=0).llm_chain.prompt
+    for text in texts:
+        parts = find_sections(text)
+        for part_name, section in parts.items():
+            combined_text = section_input_text(section.text, part_name, parts)
+            for question in rubric.criteria(part_name):
+                prompt = rubric.render(part_name, question, combined_text)
+                yield chat_prompt.format(context=combined_text, question=prompt)
+
+
+def measure(rubric: CompiledRubric, texts: list):
+    total = shared = requests = 0
+    previous = ""
+    for request in rubric_requests(rubric, texts):
+        total += estimate_tokens(request)
+        shared += estimate_tokens(os.path.commonprefix([previous, request]))
+        requests += 1
+        previous = request
+    return requests, total, shared
+
+
+def main(args):
+    path = rubric_file
+    if args[:1] == ["--rubric"]:
+        path, args = args[1], args[2:]
+
+    texts = []
+    for file_name in args:
+        with open(file_name, "r", encoding="utf-8") as file:
+            texts.append(file.read())
+    texts = texts or [build_document()]
+
+    print(f"Rubric: {path}, documents: {len(texts)}")
+    for layout in ["classic", "prefix"]:
+        requests, total, shared = measure(CompiledRubric(path, layout), texts)
+        ratio = shared / total if total else 0.0
+        print(f"{layout:>8}: {requests} requests, ~{total} prompt tokens, ~{shared} shared with the previous "
+              f"request ({ratio:.0%} reusable from the prompt cache)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+"""Synthetic project proposals (PDF and DOCX) with the section structure of the real submissions.
+
+Each proposal has the part titles of llm_processing.part_titles: a Project Description / Purpose, a
+ruled Project Overview table (Problem Summary, Desired Outcome(s), Benefits), a ruled Timeline table
+starting with a "Task" row, a Project Scope with in and out of scope objectives and a Project Team
+table. Filler paragraphs in the description and scope bring a document to the requested page count.
+
+Usage (from the repository root):
+    python -m Benchmarks.synthetic_proposals output_folder [pages ...]
+"""
+import os
+import sys
+import random
+import textwrap
+import fitz
+from docx import Document as DocxDocument
+
+
+page_width, page_height = 595, 842
+margin = 50
+font_size = 10
+line_height = 14
+wrap_width = 95
+
+sentences = [
+    "Screening clients for Health-Related Social Needs is needed to understand their social determinants of health.",
+    "The clinic does not currently use a standard screening tool on a consistent basis.",
+    "Care coordinators will refer clients with a positive screen to community partners within 30 days.",
+    "Staff will be trained on the screening workflow and on documenting the matching Z codes.",
+    "Monthly reports will track the share of completed screenings and closed referrals.",
+    "The team will meet every two weeks to review progress and adjust the workflow.",
+    "Data from the electronic health record will be used to measure the outcomes of the project.",
+    "Clients will receive printed information about local food, housing and transportation resources.",
+]
+
+
+def paragraph(rng, sentence_count):
+    return " ".join(rng.choice(sentences) for _ in range(sentence_count))
+
+
+# Sections of a proposal as (title, paragraphs, table rows); filler paragraphs sized for the page count
+def proposal_sections(pages, seed=0):
+    rng = random.Random(seed)
+    filler = max(0, pages - 1) * 9
+
+    description = [
+        "The purpose of this project is to increase the percentage of completed screenings to at least 85% "
+        "of clients seen between October 1, 2024, and March 31, 2025.",
+        paragraph(rng, 4),
+    ] + [paragraph(rng, 5) for _ in range(filler // 2)]
+    overview = [
+        ["Problem Summary", paragraph(rng, 3)],
+        ["Desired Outcome(s)", "Screen 85% of clients by March 31, 2025 and refer 50% of positive screens."],
+        ["Benefits", "Earlier identification of social needs, better adherence and fewer avoidable visits."],
+    ]
+    timeline = [["Task", "Start", "End"], ["Train staff", "10/01/2024", "10/31/2024"],
+                ["Screen clients", "11/01/2024", "03/31/2025"], ["Report results", "04/01/2025", "04/30/2025"]]
+    scope = [
+        "In Scope Project Objectives: " + paragraph(rng, 3),
+        "Out of Scope Project Objectives or Activities: Changes to billing and scheduling systems.",
+    ] + [paragraph(rng, 5) for _ in range(filler - filler // 2)]
+    team = [["Name", "Role"], ["Alex Kim", "Project Lead"], ["Sam Lee", "Care Coordinator"],
+            ["Jordan Diaz", "Data Analyst"]]
+
+    return [
+        ("Project Description / Purpose", description, None),
+        ("Project Overview", [], overview),
+        ("Timeline", [], timeline),
+        ("Project Scope", scope, None),
+        ("Project Team", [], team),
+    ]
+
+
+class PdfWriter():
+    def __init__(self) -> None:
+        self.document = fitz.open()
+        self.new_page()
+
+    def new_page(self):
+        self.page = self.document.new_page(width=page_width, height=page_height)
+        self.y = margin
+
+    def ensure_space(self, height):
+        if self.y + height > page_height - margin:
+            self.new_page()
+
+    def text(self, text, bold=False):
+        for line in textwrap.wrap(text, wrap_width) or [""]:
+            self.ensure_space(line_height)
+            self.page.insert_text((margin, self.y + font_size), line, fontsize=font_size,
+                                  fontname="helv" if not bold else "hebo")
+            self.y += line_height
+        self.y += line_height / 2
+
+    # Ruled table: every cell boxed, so camelot lattice finds it
+    def table(self, rows):
+        column_width = (page_width - 2 * margin) / len(rows[0])
+        for row in rows:
+            cells = [textwrap.wrap(cell, int(wrap_width / len(row)) - 2) or [""] for cell in row]
+            height = max(len(lines) for lines in cells) * line_height + 6
+            self.ensure_space(height)
+            for column, lines in enumerate(cells):
+                x = margin + column * column_width
+                self.page.draw_rect(fitz.Rect(x, self.y, x + column_width, self.y + height), width=0.8)
+                for index, line in enumerate(lines):
+                    self.page.insert_text((x + 4, self.y + 3 + font_size + index * line_height), line,
+                                          fontsize=font_size)
+            self.y += height
+        self.y += line_height
+
+    def save(self, path):
+        self.document.save(path)
+        self.document.close()
+
+
+def write_proposal_pdf(path, pages, seed=0):
+    writer = PdfWriter()
+    for title, paragraphs, rows in proposal_sections(pages, seed):
+        writer.text(title, bold=True)
+        for text in paragraphs:
+            writer.text(text)
+        if rows:
+            writer.table(rows)
+    page_count = len(writer.document)
+    writer.save(path)
+    return page_count
+
+
+def write_proposal_docx(path, pages, seed=0):
+    document = DocxDocument()
+    for title, paragraphs, rows in proposal_sections(pages, seed):
+        document.add_paragraph(title).runs[0].bold = True
+        for text in paragraphs:
+            document.add_paragraph(text)
+        if rows:
+            table = document.add_table(rows=len(rows), cols=len(rows[0]))
+            table.style = "Table Grid"
+            for row, values in zip(table.rows, rows):
+                for cell, value in zip(row.cells, values):
+                    cell.text = value
+    document.save(path)
+
+
+# One PDF and one DOCX proposal per page count; returns the file paths
+def write_corpus(folder, page_counts, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for pages in page_counts:
+        pdf_path = os.path.join(folder, f"proposal_{pages:03d}p.pdf")
+        docx_path = os.path.join(folder, f"proposal_{pages:03d}p.docx")
+        write_proposal_pdf(pdf_path, pages, seed)
+        write_proposal_docx(docx_path, pages, seed)
+        paths += [pdf_path, docx_path]
+    return paths
+
+
+if __name__ == "__main__":
+    output_folder = sys.argv[1] if len(sys.argv) > 1 else "Documents/NewlyUploaded"
+    sizes = [int(size) for size in sys.argv[2:]] or [2, 10, 50, 120]
+    for file_path in write_corpus(output_folder, sizes):
+        print(file_path)
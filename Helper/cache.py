@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+# Hash a file's bytes without loading the whole file in memory
+def file_sha256(path: str, block_size: int = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Build a cache key from a content hash, a version string and the settings that affect the output
+def cache_key(content_hash: str, version: str, settings: dict = None):
+    payload = json.dumps({"content": content_hash, "version": version, "settings": settings or {}},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Small SQLite key/value store with size based LRU eviction, optional max age and hit/miss counters
+class DiskCache():
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, max_age: float = None) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.session_hits = 0
+        self.session_misses = 0
+        self.lock = threading.Lock()
+
+        # Several worker processes may share the file, so use WAL and wait on locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,
+                                created REAL NOT NULL, accessed REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name: str):
+        self.conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                          "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.session_misses += 1
+                self._count("misses")
+                return None
+
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.session_hits += 1
+            self._count("hits")
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, value, size, created, accessed) "
+                              "VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self._evict(now)
+
+    # Drop expired entries, then the least recently used ones until the store fits in max_bytes
+    def _evict(self, now: float):
+        if self.max_age is not None:
+            self.conn.execute("DELETE FROM entries WHERE created < ?", (now - self.max_age,))
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self.conn.execute("INSERT INTO counters (name, value) VALUES ('evictions', ?) "
+                          "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (len(evicted),))
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+
+    # Counters persisted across sessions plus the ones of this process
+    def stats(self):
+        with self.lock:
+            counters = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "session_hits": self.session_hits,
+            "session_misses": self.session_misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
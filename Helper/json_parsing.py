@@ -0,0 +1,111 @@
+import re
+import json
+
+
+code_fence = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+json_object = re.compile(r"\{.*\}", re.DOTALL)
+python_literals = {"True": "true", "False": "false", "None": "null"}
+string_escapes = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+# Text inside a ```json code fence, or the whole text when there is none
+def strip_code_fence(text: str):
+    match = code_fence.search(text)
+    return match.group(1) if match else text
+
+
+def drop_trailing_comma(out: list):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+# Rewrite the first almost-JSON object of a text into JSON: single quoted strings, trailing commas,
+# Python literals, raw line breaks in strings and objects cut off before their end
+def repair_json(text: str):
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    out = []
+    closers = []
+    quote = None
+    i = start
+    while i < len(text):
+        ch = text[i]
+
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                escaped = text[i + 1]
+                out.append("'" if escaped == "'" else ch + escaped)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            else:
+                out.append(string_escapes.get(ch, ch))
+            i += 1
+            continue
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            if ch in closers:
+                while closers:
+                    drop_trailing_comma(out)
+                    closer = closers.pop()
+                    out.append(closer)
+                    if closer == ch:
+                        break
+            if not closers:
+                break
+        elif ch.isalpha():
+            word = re.match(r"[A-Za-z]+", text[i:]).group()
+            out.append(python_literals.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # Close whatever the answer left open
+    if quote:
+        out.append('"')
+    if closers:
+        drop_trailing_comma(out)
+        if out and out[-1] == ":":
+            out.append("null")
+        while closers:
+            drop_trailing_comma(out)
+            out.append(closers.pop())
+
+    return "".join(out)
+
+
+# Parse the JSON object of an LLM answer without asking the LLM again.
+# Returns (object, repaired) where repaired tells whether the answer needed local fixes, or (None, False).
+def parse_llm_json(text: str):
+    match = json_object.search(text)
+    if match:
+        try:
+            return json.loads(match.group()), False
+        except json.JSONDecodeError:
+            pass
+
+    repaired = repair_json(strip_code_fence(text))
+    if repaired is None:
+        return None, False
+
+    try:
+        result = json.loads(repaired)
+    except json.JSONDecodeError:
+        return None, False
+    return (result, True) if isinstance(result, dict) else (None, False)
@@ -0,0 +1,431 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+import requests
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from typing import Any, Iterator, List, Optional, Union
+from requests.adapters import HTTPAdapter
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from langchain.chains.question_answering import load_qa_chain
+from Helper.llm_router import BackendRouter, Endpoint, parse_endpoints
+from Helper.llm_recording import Recorder
+from Helper.ollama_stub import OllamaStub, parse_latency
+from dotenv import load_dotenv
+
+
+# Load environment settings (this module can be imported before the modules that load them)
+load_dotenv()
+
+
+# Keep-alive connections kept per Ollama host
+pool_size = int(os.getenv("LLM_POOL_SIZE", "8"))
+
+# Ollama servers to spread the calls over ("http://box1:11434=2,http://box2:11434", weight after "=");
+# empty to send everything to the client's base_url
+ollama_endpoints = os.getenv("OLLAMA_ENDPOINTS", "")
+router = None
+
+# Calls with the same affinity key (the section input of the prompt) go to the server that served the key last,
+# unless it has more than LLM_AFFINITY_SLACK outstanding requests (per unit of weight) above the least loaded one
+affinity_slack = float(os.getenv("LLM_AFFINITY_SLACK", "2"))
+prompt_affinity = contextvars.ContextVar("prompt_affinity", default=None)
+
+# Append every prompt and answer to this JSONL file (empty to record nothing)
+llm_record_path = os.getenv("LLM_RECORD", "")
+recorder = Recorder(llm_record_path) if llm_record_path else None
+
+# Answer from an in-process stub server instead of Ollama: "synthetic" or the path of a recording to replay,
+# with a latency distribution such as "normal:0.5:0.1" or "recorded"
+llm_stub = os.getenv("LLM_STUB", "")
+llm_stub_latency = os.getenv("LLM_STUB_LATENCY", "fixed:0")
+stub = None
+
+# Limits of one LLM call: seconds before it counts as hung (LLM_TIMEOUT, also the socket timeout of the client),
+# retries of failed or timed out calls after a jittered exponential backoff (LLM_RETRIES, LLM_RETRY_BACKOFF
+# seconds for the first retry) and failed calls in a row that open the circuit breaker of a server
+llm_timeout = int(os.getenv("LLM_TIMEOUT", "120"))
+llm_retries = int(os.getenv("LLM_RETRIES", "2"))
+llm_retry_backoff = float(os.getenv("LLM_RETRY_BACKOFF", "1.0"))
+breaker_failures = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+
+# Hedged calls: when a call is slower than the p95 latency of its client, the same call is sent again
+# and the first answer wins (needs hedge_min_samples calls of the client to know its p95)
+hedging_enabled = os.getenv("LLM_HEDGE", "0") == "1"
+hedge_min_samples = 20
+resilience_stats = {}
+
+# time.monotonic() by which the current call has to be answered (set by timed_call for the calls it starts)
+call_deadline = contextvars.ContextVar("call_deadline", default=None)
+
+sessions = {}
+clients = {}
+chains = {}
+latencies = {}
+local_routers = {}
+pool_lock = threading.Lock()
+
+
+# A server answered with a 5xx error: worth another try, unlike a request the server rejects
+class LLMServerError(ValueError):
+    pass
+
+
+# One requests session (and connection pool) per Ollama host, shared by every client of that host
+def get_session(base_url: str):
+    with pool_lock:
+        session = sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            sessions[base_url] = session
+        return session
+
+
+# Router over OLLAMA_ENDPOINTS, created and health checked on first use (None without endpoints)
+def get_router():
+    global router, stub
+    with pool_lock:
+        if router is not None or not (ollama_endpoints or llm_stub):
+            return router
+
+        if llm_stub:
+            distribution, latency, jitter = parse_latency(llm_stub_latency)
+            stub = OllamaStub(latency=latency, jitter=jitter, distribution=distribution,
+                              replay=None if llm_stub == "synthetic" else llm_stub).start()
+            print(f"[INFO] Answering LLM calls from the stub server at {stub.url} ({llm_stub})")
+            router = BackendRouter([Endpoint(stub.url)], failure_threshold=breaker_failures,
+                                   affinity_slack=affinity_slack)
+        else:
+            router = BackendRouter(parse_endpoints(ollama_endpoints), failure_threshold=breaker_failures,
+                                   affinity_slack=affinity_slack)
+        created = router
+    print(f"[INFO] LLM endpoints: {created.check_health()}")
+    return created
+
+
+# Route the calls over other endpoints (e.g. local stub servers) from now on
+def use_endpoints(endpoints: list, retry_seconds: float = 30.0):
+    global router
+    created = BackendRouter(endpoints, retry_seconds=retry_seconds, failure_threshold=breaker_failures,
+                            affinity_slack=affinity_slack)
+    created.check_health()
+    with pool_lock:
+        router = created
+    return created
+
+
+# Router over the base_url of a client, for the circuit breaker when OLLAMA_ENDPOINTS is not set
+def local_router(base_url: str):
+    with pool_lock:
+        created = local_routers.get(base_url)
+        if created is None:
+            created = BackendRouter([Endpoint(base_url)], failure_threshold=breaker_failures)
+            local_routers[base_url] = created
+        return created
+
+
+# Error of an Ollama answer that is not a 200
+def status_error(response, model: str):
+    if response.status_code == 404:
+        return OllamaEndpointNotFoundError(
+            "Ollama call failed with status code 404. Maybe your model is not found "
+            f"and you should pull the model with `ollama pull {model}`.")
+    error_type = LLMServerError if response.status_code >= 500 else ValueError
+    return error_type(f"Ollama call failed with status code {response.status_code}. Details: {response.text}")
+
+
+def record_latency(key: str, seconds: float):
+    with pool_lock:
+        latencies.setdefault(key, []).append(seconds)
+
+
+# ChatOllama whose requests go through the shared session instead of a new connection per call
+class PooledChatOllama(ChatOllama):
+    pool_key: str = ""
+    # "json" or a JSON schema the answer has to follow
+    format: Optional[Union[str, dict]] = None
+
+    # Same request as ChatOllama._create_stream (langchain-community 0.3), sent with the pooled session
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None,
+                       **kwargs: Any) -> Iterator[str]:
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+        start = time.perf_counter()
+        backend_router = get_router() or local_router(self.base_url)
+
+        # Failover: try the other endpoints when one cannot be reached or answers with an error
+        path = api_url[len(self.base_url):]
+        tried = []
+        error = None
+        while True:
+            endpoint = backend_router.acquire(tried, prompt_affinity.get())
+            if endpoint is None and not tried:
+                # Every server is out of rotation: wait for one to come back within the call's time
+                deadline = call_deadline.get() or time.monotonic() + llm_timeout
+                print(f"[WARNING] No LLM endpoint available, waiting up to {max(0.0, deadline - time.monotonic()):.0f}s "
+                      f"for one to come back")
+                endpoint = backend_router.wait_for_endpoint(deadline)
+            if endpoint is None:
+                record_latency(self.pool_key, time.perf_counter() - start)
+                raise error or ConnectionError("No healthy LLM endpoint available")
+            tried.append(endpoint)
+
+            call_start = time.perf_counter()
+            try:
+                response = self._post(endpoint.url, f"{endpoint.url}{path}", request_payload)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                backend_router.release(endpoint, time.perf_counter() - call_start, failed=True)
+                error = e
+                continue
+
+            if response.status_code != 200:
+                # A missing model is a problem of the request, not of the server
+                backend_router.release(endpoint, time.perf_counter() - call_start,
+                                       failed=response.status_code >= 500)
+                error = status_error(response, self.model)
+                response.close()
+                continue
+
+            return self._timed_lines(response, start, request_payload, backend_router, endpoint, call_start)
+
+    def _post(self, base_url: str, api_url: str, request_payload: dict):
+        response = get_session(base_url).post(
+            url=api_url,
+            headers={"Content-Type": "application/json",
+                     **(self.headers if isinstance(self.headers, dict) else {})},
+            auth=self.auth,
+            json=request_payload,
+            stream=True,
+            timeout=self.timeout,
+        )
+        response.encoding = "utf-8"
+        return response
+
+    # Stream the answer and record the full request latency once it has been read
+    def _timed_lines(self, response, start: float, request_payload: dict, backend_router, endpoint,
+                     call_start: float):
+        failed = False
+        answer = []
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if recorder is not None and line:
+                    chunk = json.loads(line)
+                    answer.append(chunk.get("message", {}).get("content", "") or chunk.get("response", ""))
+                yield line
+            if recorder is not None:
+                recorder.record(request_payload, "".join(answer), time.perf_counter() - start)
+        except requests.RequestException:
+            failed = True
+            raise
+        finally:
+            record_latency(self.pool_key, time.perf_counter() - start)
+            backend_router.release(endpoint, time.perf_counter() - call_start, failed=failed)
+            response.close()
+
+
+# Key of a client: model name plus its parameters
+def client_key(model: str, params: dict):
+    return json.dumps({"model": model, **params}, sort_keys=True, default=str)
+
+
+# Shared chat client for a model and parameter set (created on first use)
+def get_llm(model: str = "llama3", **params):
+    key = client_key(model, params)
+    with pool_lock:
+        llm = clients.get(key)
+        if llm is None:
+            llm = PooledChatOllama(model=model, pool_key=key, **{"timeout": llm_timeout, **params})
+            clients[key] = llm
+        return llm
+
+
+# Shared question answering chain on top of the shared client
+def get_chain(model: str = "llama3", **params):
+    key = client_key(model, params)
+    llm = get_llm(model, **params)
+    with pool_lock:
+        chain = chains.get(key)
+        if chain is None:
+            chain = load_qa_chain(llm=llm)
+            chains[key] = chain
+        return chain
+
+
+# Shared chain using the same client settings as another shared chain, with some parameters changed
+def get_chain_variant(chain, **params):
+    settings = json.loads(chain.llm_chain.llm.pool_key)
+    model = settings.pop("model")
+    return get_chain(model, **{**settings, **params})
+
+
+def count_resilience(name: str):
+    with pool_lock:
+        resilience_stats[name] = resilience_stats.get(name, 0) + 1
+
+
+# Failures worth another try: the server could not be reached, timed out, failed or had its breaker open
+def is_retryable(error: Exception):
+    return isinstance(error, (requests.RequestException, ConnectionError, TimeoutError, LLMServerError))
+
+
+# Run a call in a daemon thread (a hung call never blocks the exit), in a copy of the caller's context
+def start_call(func, *args, **kwargs):
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(func, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+# Seconds after which a call of the client is hedged (None without hedging or enough latencies)
+def hedge_delay(pool_key: str):
+    if not hedging_enabled:
+        return None
+    with pool_lock:
+        values = latencies.get(pool_key, [])
+        if len(values) < hedge_min_samples:
+            return None
+        return percentile(values, 0.95)
+
+
+# One attempt of a call: the first answer within LLM_TIMEOUT, with a hedged second call after the p95 delay.
+# A call still running when the other answers, or after the timeout, is left to finish in the background
+def timed_call(pool_key: str, func, *args, **kwargs):
+    deadline = time.monotonic() + llm_timeout
+    token = call_deadline.set(deadline)
+    try:
+        calls = [start_call(func, *args, **kwargs)]
+    finally:
+        call_deadline.reset(token)
+
+    delay = hedge_delay(pool_key)
+    if delay is not None and delay < llm_timeout:
+        done, _ = wait(calls, timeout=delay)
+        if not done:
+            count_resilience("hedged")
+            # The hedge goes to the least loaded server, not to the one the slow call is waiting on
+            token = call_deadline.set(deadline)
+            affinity_token = prompt_affinity.set(None)
+            try:
+                calls.append(start_call(func, *args, **kwargs))
+            finally:
+                prompt_affinity.reset(affinity_token)
+                call_deadline.reset(token)
+
+    error = None
+    pending = set(calls)
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            count_resilience("timeouts")
+            raise TimeoutError(f"LLM call took longer than {llm_timeout}s")
+        for call in done:
+            if call.exception() is None:
+                if call is not calls[0]:
+                    count_resilience("hedge_wins")
+                return call.result()
+            error = call.exception()
+    raise error
+
+
+# Call an LLM (e.g. chain.run) with the timeout, hedging and retries of the pool; the last error is raised
+# once the retries are used up
+def resilient_call(pool_key: str, func, *args, **kwargs):
+    for attempt in range(llm_retries + 1):
+        try:
+            return timed_call(pool_key, func, *args, **kwargs)
+        except Exception as e:
+            if attempt == llm_retries or not is_retryable(e):
+                count_resilience("failures")
+                raise
+            backoff = random.uniform(0, llm_retry_backoff * 2 ** attempt)
+            count_resilience("retries")
+            print(f"[WARNING] LLM call failed ({e}), retry {attempt + 1}/{llm_retries} in {backoff:.1f}s")
+            time.sleep(backoff)
+
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Connection reuse per host and request latency per client
+def pool_stats():
+    stats = {"hosts": {}, "clients": {}}
+
+    with pool_lock:
+        for base_url, session in sessions.items():
+            adapter = session.get_adapter(base_url)
+            requests_sent = new_connections = 0
+            for pool_key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[pool_key]
+                requests_sent += pool.num_requests
+                new_connections += pool.num_connections
+            stats["hosts"][base_url] = {"requests": requests_sent, "new_connections": new_connections,
+                                        "reused": requests_sent - new_connections}
+
+        for key, values in latencies.items():
+            if values:
+                stats["clients"][key] = {"requests": len(values), "mean": sum(values) / len(values),
+                                         "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+    return stats
+
+
+def report_pool_stats():
+    stats = pool_stats()
+    with pool_lock:
+        routers = [router] if router is not None else []
+        routers += list(local_routers.values())
+        resilience = dict(resilience_stats)
+        resilience_stats.clear()
+
+    for backend_router in routers:
+        for url, endpoint in backend_router.stats().items():
+            print(f"[INFO] LLM endpoint {url} (weight {endpoint['weight']:g}): {endpoint['requests']} requests, "
+                  f"{endpoint['failures']} failed, {endpoint['affinity_hits']} sent back for prompt cache reuse, "
+                  f"mean {endpoint['mean']:.2f}s, "
+                  f"{'healthy' if endpoint['healthy'] else 'down'}")
+    for base_url, host in stats["hosts"].items():
+        print(f"[INFO] LLM connections to {base_url}: {host['requests']} requests over "
+              f"{host['new_connections']} connections ({host['reused']} reused)")
+    for key, client in stats["clients"].items():
+        print(f"[INFO] LLM latency for {key}: {client['requests']} requests, mean {client['mean']:.2f}s, "
+              f"p50 {client['p50']:.2f}s, p95 {client['p95']:.2f}s")
+    if resilience:
+        print(f"[INFO] LLM call resilience: {resilience.get('retries', 0)} retries, "
+              f"{resilience.get('timeouts', 0)} timeouts, {resilience.get('hedged', 0)} hedged calls "
+              f"({resilience.get('hedge_wins', 0)} won by the hedge), {resilience.get('failures', 0)} calls failed")
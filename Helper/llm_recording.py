@@ -0,0 +1,47 @@
+import os
+import json
+import hashlib
+import threading
+
+
+# Key of an Ollama request: what decides the answer of a deterministic model
+def request_key(payload: dict):
+    content = {"model": payload.get("model"), "format": payload.get("format"),
+               "messages": payload.get("messages"), "prompt": payload.get("prompt")}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Text of a request as the model reads it last (the question of a chat, or the prompt)
+def request_prompt(payload: dict):
+    if payload.get("messages"):
+        return payload["messages"][-1].get("content", "")
+    return payload.get("prompt", "")
+
+
+# Appends every answered request to a JSONL file: one {"key", "model", "prompt", "response", "seconds"} per line
+class Recorder():
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, payload: dict, response: str, seconds: float):
+        line = json.dumps({"key": request_key(payload), "model": payload.get("model"),
+                           "prompt": request_prompt(payload), "response": response, "seconds": round(seconds, 4)},
+                          ensure_ascii=False)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+
+
+# Recorded answers by request key (the last recording of a request wins)
+def load_recordings(path: str):
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record
+    return recordings
@@ -0,0 +1,154 @@
+import time
+import threading
+from collections import OrderedDict
+import requests
+
+
+# One Ollama server of the pool, with its capacity weight and live counters
+class Endpoint():
+    def __init__(self, url: str, weight: float = 1.0) -> None:
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.healthy = True
+        self.retry_at = 0.0
+        self.consecutive_failures = 0
+        self.affinity_hits = 0
+
+
+# "http://box1:11434=2,http://box2:11434" -> endpoints with weights 2 and 1
+def parse_endpoints(value: str):
+    endpoints = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.rpartition("=")
+        try:
+            endpoints.append(Endpoint(url, float(weight)))
+        except ValueError:
+            endpoints.append(Endpoint(item))
+    return endpoints
+
+
+# Spreads LLM calls over several Ollama servers: least outstanding requests relative to the weight.
+# Each server has a circuit breaker: after failure_threshold failed calls in a row it is skipped until a
+# health check passes again, and one more failure after that opens it again.
+# Calls with an affinity key (e.g. the section input their prompt starts with) go back to the server that
+# served the key last, where the prompt is still cached, unless that server is down or has more than
+# affinity_slack outstanding requests (relative to its weight) above the least loaded one
+class BackendRouter():
+    def __init__(self, endpoints: list, retry_seconds: float = 30.0, probe_timeout: float = 2.0,
+                 failure_threshold: int = 1, affinity_slack: float = 2.0, affinity_keys: int = 4096) -> None:
+        self.endpoints = [endpoint for endpoint in endpoints if endpoint.weight > 0]
+        self.retry_seconds = retry_seconds
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.affinity_slack = affinity_slack
+        self.affinity_keys = affinity_keys
+        self.affinity = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Ollama lists its models on /api/tags; any 200 answer means the server is up
+    def probe(self, endpoint: Endpoint):
+        try:
+            return requests.get(f"{endpoint.url}/api/tags", timeout=self.probe_timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def check_health(self):
+        for endpoint in self.endpoints:
+            healthy = self.probe(endpoint)
+            with self.lock:
+                endpoint.healthy = healthy
+                endpoint.retry_at = 0.0 if healthy else time.monotonic() + self.retry_seconds
+        return {endpoint.url: endpoint.healthy for endpoint in self.endpoints}
+
+    # Probe the failed servers whose retry time has come; one caller probes, the others wait for the next retry
+    def recover(self, exclude):
+        now = time.monotonic()
+        with self.lock:
+            due = [endpoint for endpoint in self.endpoints
+                   if not endpoint.healthy and endpoint.retry_at <= now and endpoint not in exclude]
+            for endpoint in due:
+                endpoint.retry_at = now + self.retry_seconds
+
+        for endpoint in due:
+            if self.probe(endpoint):
+                with self.lock:
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = self.failure_threshold - 1
+                print(f"[INFO] LLM endpoint {endpoint.url} is back")
+
+    # Outstanding requests of a server with one more call, relative to its capacity
+    def load(self, endpoint: Endpoint):
+        return (endpoint.outstanding + 1) / endpoint.weight
+
+    # Endpoint for the next call (None when every server is down or was already tried)
+    def acquire(self, exclude=(), affinity_key=None):
+        self.recover(exclude)
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint not in exclude]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=self.load)
+
+            if affinity_key is not None:
+                previous = self.affinity.get(affinity_key)
+                if previous in candidates and self.load(previous) <= self.load(endpoint) + self.affinity_slack:
+                    endpoint = previous
+                if endpoint is previous:
+                    endpoint.affinity_hits += 1
+                self.affinity[affinity_key] = endpoint
+                self.affinity.move_to_end(affinity_key)
+                if len(self.affinity) > self.affinity_keys:
+                    self.affinity.popitem(last=False)
+
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    # Endpoint for a call when every server is out of rotation: instead of failing until the next retry,
+    # probe them every probe_interval seconds until one is back or the deadline (time.monotonic()) passes
+    def wait_for_endpoint(self, deadline: float, probe_interval: float = 1.0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for endpoint in self.endpoints:
+                    # retry_at - retry_seconds is the time of the last probe
+                    if not endpoint.healthy and endpoint.retry_at - self.retry_seconds + probe_interval <= now:
+                        endpoint.retry_at = now
+
+            endpoint = self.acquire()
+            if endpoint is not None or time.monotonic() >= deadline:
+                return endpoint
+            time.sleep(max(0.0, min(probe_interval, deadline - time.monotonic())))
+
+    def release(self, endpoint: Endpoint, seconds: float, failed: bool = False):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.seconds += seconds
+            if not failed:
+                endpoint.consecutive_failures = 0
+                return
+
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures < self.failure_threshold:
+                return
+            if endpoint.healthy:
+                print(f"[WARNING] LLM endpoint {endpoint.url} failed {endpoint.consecutive_failures} times in a row, "
+                      f"retrying it in {self.retry_seconds:.0f}s")
+            endpoint.healthy = False
+            endpoint.retry_at = time.monotonic() + self.retry_seconds
+
+    def stats(self):
+        with self.lock:
+            return {endpoint.url: {"weight": endpoint.weight, "requests": endpoint.requests,
+                                   "failures": endpoint.failures, "outstanding": endpoint.outstanding,
+                                   "healthy": endpoint.healthy, "affinity_hits": endpoint.affinity_hits,
+                                   "mean": endpoint.seconds / endpoint.requests if endpoint.requests else 0.0}
+                    for endpoint in self.endpoints}
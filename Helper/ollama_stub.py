@@ -0,0 +1,175 @@
+"""Local stand-in for an Ollama server, to run the grader without a model.
+
+Answers /api/chat and /api/generate after a simulated latency, and /api/tags for health checks.
+With --replay, requests recorded with LLM_RECORD get their recorded answer; other requests get a
+filled-in copy of the JSON template at the end of the prompt.
+
+Usage (from the repository root):
+    python -m Helper.ollama_stub [--port 11500] [--replay Documents/Recordings/llm.jsonl]
+                                 [--distribution normal] [--latency 0.5] [--jitter 0.2] [--failure-rate 0.0]
+
+Then point the grader at it, e.g. OLLAMA_ENDPOINTS=http://127.0.0.1:11500,http://127.0.0.1:11501,
+or let the grader start one in process with LLM_STUB=synthetic (or LLM_STUB=<recording>).
+"""
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Helper.llm_recording import request_key, request_prompt, load_recordings
+
+
+response_template = re.compile(r"Respond only with JSON[^\n]*\n(.*\})", re.DOTALL)
+
+
+# Answer shaped like the response template of a rubric prompt, every criterion scored 1
+def synthetic_answer(prompt: str):
+    match = response_template.search(prompt)
+    if not match:
+        return json.dumps({"answer": "stub"})
+    template = match.group(1)
+    template = template.replace('"score": ""', '"score": 1')
+    return template.replace('"explanation": ""', '"explanation": "Stub answer."')
+
+
+# "normal:0.5:0.1" -> ("normal", 0.5, 0.1); "recorded" and "fixed:0.2" need fewer fields
+def parse_latency(spec: str):
+    fields = spec.split(":")
+    distribution = fields[0] or "fixed"
+    latency = float(fields[1]) if len(fields) > 1 else 0.0
+    jitter = float(fields[2]) if len(fields) > 2 else 0.0
+    return distribution, latency, jitter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json_lines(self, status: int, lines: list):
+        body = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json_lines(200, [{"models": [{"name": f"{model}:latest"} for model in self.server.models]}])
+        else:
+            self.send_json_lines(404, [{"error": "not found"}])
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        stub = self.server
+        with stub.lock:
+            stub.requests += 1
+            stub.outstanding += 1
+            stub.max_outstanding = max(stub.max_outstanding, stub.outstanding)
+
+        try:
+            answer, recorded_seconds = stub.respond(request)
+            time.sleep(stub.sample_latency(recorded_seconds))
+            if random.random() < stub.failure_rate:
+                self.send_json_lines(500, [{"error": "simulated failure"}])
+                return
+
+            if self.path == "/api/chat":
+                self.send_json_lines(200, [
+                    {"model": request.get("model"), "message": {"role": "assistant", "content": answer}, "done": False},
+                    {"model": request.get("model"), "message": {"role": "assistant", "content": ""}, "done": True}])
+            elif self.path == "/api/generate":
+                self.send_json_lines(200, [{"model": request.get("model"), "response": answer, "done": False},
+                                           {"model": request.get("model"), "response": "", "done": True}])
+            else:
+                self.send_json_lines(404, [{"error": "not found"}])
+        finally:
+            with stub.lock:
+                stub.outstanding -= 1
+
+
+# Stub server running in a background thread; port 0 picks a free port
+class OllamaStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 answer=synthetic_answer, models=("llama3",), distribution: str = "normal",
+                 replay: str = None) -> None:
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self.models = list(models)
+        self.recordings = load_recordings(replay) if replay else {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.replayed = 0
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    # Recorded answer and its recorded latency, or a synthetic answer
+    def respond(self, request: dict):
+        record = self.recordings.get(request_key(request))
+        if record is None:
+            return self.answer(request_prompt(request)), None
+        with self.lock:
+            self.replayed += 1
+        return record["response"], record.get("seconds")
+
+    # Simulated answer time: fixed, normal (mean, standard deviation), lognormal (mean, standard deviation),
+    # exponential (mean) or recorded (the recorded time, the normal distribution for synthetic answers)
+    def sample_latency(self, recorded_seconds: float = None):
+        if self.distribution == "recorded" and recorded_seconds is not None:
+            return recorded_seconds
+        if self.distribution == "fixed" or self.latency <= 0:
+            return max(0.0, self.latency)
+        if self.distribution == "lognormal":
+            sigma = math.sqrt(math.log(1 + (self.jitter / self.latency) ** 2))
+            return random.lognormvariate(math.log(self.latency) - sigma ** 2 / 2, sigma)
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.latency)
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Local stub of the Ollama chat API")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--replay", help="JSONL recording (LLM_RECORD) whose answers are served")
+    parser.add_argument("--distribution", default="normal",
+                        choices=["fixed", "normal", "lognormal", "exponential", "recorded"])
+    parser.add_argument("--latency", type=float, default=0.5, help="mean answer time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the answer time")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls answered with a 500")
+    options = parser.parse_args(args)
+
+    stub = OllamaStub(options.port, options.latency, options.jitter, options.failure_rate,
+                      distribution=options.distribution, replay=options.replay)
+    print(f"Ollama stub listening on {stub.url} ({len(stub.recordings)} recorded answers)")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
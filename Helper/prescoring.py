@@ -0,0 +1,137 @@
+import re
+import threading
+
+
+# Rules settle only the clear-cut cases of a criterion; anything else returns None and goes to the LLM
+# Sentences end with a stop or a line break, so bullet and list items count as sentences too
+sentence_end = re.compile(r"[.!?]+(?:\s+|$)|\n+")
+# A description is only too brief for certain below this many words; longer ones go to the LLM
+min_description_words = 15
+purpose_phrase = re.compile(r"\b(?:the\s+(?:main\s+)?(?:purpose|aim|goal|objective)\s+of\s+(?:this|the)\s+project\s+is"
+                            r"|this\s+project\s+(?:is\s+to|aims\s+to|will\s+aim\s+to|seeks\s+to))\b", re.IGNORECASE)
+result_phrase = re.compile(r"\b(?:expected\s+(?:results?|outcomes?)|we\s+(?:anticipate|expect)|"
+                           r"(?:is|are)\s+expected\s+to\s+(?:increase|decrease|reduce|improve))\b", re.IGNORECASE)
+percentage = re.compile(r"\b\d{1,3}(?:\.\d+)?\s?%")
+date = re.compile(r"\b(?:(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+(?:\d{1,2},?\s+)?\d{4}"
+                  r"|\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{2}-\d{2}|(?:q[1-4]|quarter)\s+\d{4})\b", re.IGNORECASE)
+# Rows of the Project Overview table start with their heading
+desired_outcomes_heading = re.compile(r"^[ \t]*desired\s+outcomes?(?:\s*\(s\))?[ \t]*:?", re.IGNORECASE | re.MULTILINE)
+overview_heading = re.compile(r"^[ \t]*(?:problem\s+summary|benefits?)\b", re.IGNORECASE | re.MULTILINE)
+out_of_scope_heading = re.compile(r"out[\s-]*of[\s-]*scope[^\n:]*:?", re.IGNORECASE)
+not_applicable = re.compile(r"^(?:n\s*/?\s*a|none|not\s+applicable|tbd|-+)\.?$", re.IGNORECASE)
+
+prescoring_stats = {}
+prescoring_lock = threading.Lock()
+
+
+# Sentences of at least three words
+def count_sentences(text: str):
+    return sum(1 for sentence in sentence_end.split(text) if len(sentence.split()) >= 3)
+
+
+# Project Scope is evaluated with the Project Description in front of it; rules only look at the scope
+def scope_text(text: str):
+    return text.split("\n\nProject Scope:\n", 1)[-1]
+
+
+# Text of the 'Desired Outcome(s)' row of the Project Overview, up to the next row (None without the row)
+def desired_outcomes_text(text: str):
+    heading = desired_outcomes_heading.search(text)
+    if heading is None:
+        return None
+    next_heading = overview_heading.search(text, heading.end())
+    return text[heading.end():next_heading.start() if next_heading else len(text)]
+
+
+def brief_description(text: str):
+    sentences = count_sentences(text)
+    words = len(text.split())
+    if sentences < 2 and words < min_description_words:
+        return 0, (f"The description is too short ({sentences} sentence{'s' if sentences != 1 else ''}, "
+                   f"{words} word{'s' if words != 1 else ''}).")
+    return None
+
+
+def purpose_statement(text: str):
+    match = purpose_phrase.search(text)
+    if match:
+        return 1, f"Explicit purpose found: '{match.group()}...'"
+    return None
+
+
+def expected_results(text: str):
+    match = result_phrase.search(text)
+    if match:
+        return 1, f"Expected results found: '{match.group()}...'"
+    return None
+
+
+# A measurable target with a date in the 'Desired Outcome(s)' row is an achievable goal; vaguer outcomes need
+# the LLM (a percentage in the Problem Summary or a date in the Benefits does not count)
+def desired_outcomes(text: str):
+    outcomes = desired_outcomes_text(text)
+    if outcomes is None:
+        return None
+    target = percentage.search(outcomes)
+    deadline = date.search(outcomes)
+    if target and deadline:
+        return 1, f"Measurable outcome found: target '{target.group()}' by '{deadline.group()}'."
+    return None
+
+
+def out_of_scope(text: str):
+    heading = None
+    for heading in out_of_scope_heading.finditer(scope_text(text)):
+        pass
+    if heading is None:
+        return None
+
+    content = scope_text(text)[heading.end():].strip()
+    first_line = content.splitlines()[0].strip() if content else ""
+    if not content or not_applicable.match(first_line):
+        return 0, "The 'Out of Scope' section is missing or marked as not applicable."
+    return None
+
+
+# Rules by criterion name (the same names are used by every rubric in Prompts)
+prescoring_rules = {
+    "Question 1. Does the 'Project Description / Purpose' include a brief description of the project?":
+        brief_description,
+    "Question 2. Does the 'Project Description / Purpose' include a sentence stating the purpose of the project?":
+        purpose_statement,
+    "Question 3. Does the 'Project Description / Purpose' include expected results from the project?":
+        expected_results,
+    "Question 2. Does the 'Desired Outcome(s)' clearly state achievable goals for the project?":
+        desired_outcomes,
+    "Question 2. Does the 'Out of Scope Project Objectives or Activities' state what is outside the project's focus?":
+        out_of_scope,
+}
+
+
+# Score a criterion locally when its rule settles it: {"score", "explanation"} or None for the LLM
+def prescore(criterion_name: str, text: str):
+    rule = prescoring_rules.get(criterion_name)
+    if rule is None:
+        return None
+
+    settled = rule(text)
+    with prescoring_lock:
+        counts = prescoring_stats.setdefault(criterion_name, {"settled": 0, "sent_to_llm": 0})
+        counts["settled" if settled else "sent_to_llm"] += 1
+
+    if settled is None:
+        return None
+    score, explanation = settled
+    return {"score": score, "explanation": f"{explanation} (scored by rule)"}
+
+
+# Print how many LLM calls the rules avoided per criterion since the last report
+def report_prescoring_stats():
+    with prescoring_lock:
+        stats = dict(prescoring_stats)
+        prescoring_stats.clear()
+
+    for criterion_name, counts in stats.items():
+        total = counts["settled"] + counts["sent_to_llm"]
+        print(f"[INFO] Rule pre-scoring of {criterion_name[:60]}...: {counts['settled']}/{total} settled "
+              f"without the LLM ({counts['settled'] / total:.0%})")
@@ -0,0 +1,59 @@
+import os
+import csv
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Columns of Documents/Results/Result.csv
+result_columns = ["", "user_id", "AI_Grade", "Comment", "Section", "Criteria"]
+
+# Parquet types of the columns; grades are kept as text since a grade can be 0, 1 or FAILED
+result_schema = pa.schema([(result_columns[0], pa.int64())] +
+                          [(column, pa.string()) for column in result_columns[1:]])
+
+
+def parquet_text(value):
+    return None if value is None else str(value)
+
+
+# Writes the result rows while the batch runs: the rows of each document are appended and flushed once the
+# document is graded, so a crash keeps the documents graded before it. The CSV is complete after every
+# flush; the Parquet file (one row group per document) is readable once the sink is closed
+class ResultsSink():
+    def __init__(self, path: str, formats=("csv",)) -> None:
+        base_path = os.path.splitext(path)[0]
+        self.paths = []
+        self.rows = 0
+        self.csv_file = None
+        self.csv_writer = None
+        self.parquet_writer = None
+
+        if "csv" in formats:
+            self.paths.append(f"{base_path}.csv")
+            self.csv_file = open(self.paths[-1], "w", encoding="utf-8", newline="")
+            # Same line ending as pandas' to_csv
+            self.csv_writer = csv.writer(self.csv_file, lineterminator=os.linesep)
+            self.csv_writer.writerow(result_columns)
+            self.csv_file.flush()
+        if "parquet" in formats:
+            self.paths.append(f"{base_path}.parquet")
+            self.parquet_writer = pq.ParquetWriter(self.paths[-1], result_schema)
+
+    # Append the rows of one document (dicts keyed by result_columns) and flush them to disk
+    def write_document(self, rows: list):
+        if not rows:
+            return
+        if self.csv_writer is not None:
+            self.csv_writer.writerows([row.get(column, "") for column in result_columns] for row in rows)
+            self.csv_file.flush()
+        if self.parquet_writer is not None:
+            columns = {result_columns[0]: [row.get(result_columns[0]) for row in rows]}
+            columns.update({column: [parquet_text(row.get(column)) for row in rows] for column in result_columns[1:]})
+            self.parquet_writer.write_table(pa.table(columns, schema=result_schema))
+        self.rows += len(rows)
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
@@ -0,0 +1,41 @@
+import re
+from functools import lru_cache
+
+
+# Regex fragment for a title that tolerates extra (or missing) whitespace inside it
+def title_fragment(title: str, words: bool = False):
+    # Word mode: words must stay separated, but by any amount of whitespace
+    if words:
+        return r'\s+'.join(re.escape(word) for word in title.split())
+
+    # Character mode: whitespace may appear between any two characters ("P r o j e c t  S c o p e")
+    return r'\s*'.join(re.escape(char) for char in title if not char.isspace())
+
+
+# Pattern for a single title, compiled once per (title, mode, suffix)
+@lru_cache(maxsize=None)
+def title_pattern(title: str, words: bool = False, suffix: str = ""):
+    return re.compile(f"{title_fragment(title, words)}{suffix}", re.IGNORECASE)
+
+
+# All titles compiled into one alternation, so a line costs one search instead of one per title
+class TitleMatcher():
+    def __init__(self, titles, words: bool = False, suffix: str = "") -> None:
+        self.titles = list(titles)
+        alternation = "|".join(f"(?P<t{i}>{title_fragment(title, words)})" for i, title in enumerate(self.titles))
+
+        # Lookahead on the first characters lets the regex engine skip positions no title can start at
+        first_chars = "".join(sorted({re.escape(title.strip()[0]) for title in self.titles if title.strip()}))
+        self.pattern = re.compile(f"(?=[{first_chars}])(?:{alternation}){suffix}", re.IGNORECASE)
+
+    def _title(self, match):
+        return self.titles[int(match.lastgroup[1:])]
+
+    # Return the title found in the line, or None
+    def search(self, line: str):
+        match = self.pattern.search(line)
+        return self._title(match) if match else None
+
+    # Replace every (spaced out or differently cased) occurrence of a title with its canonical form
+    def normalize(self, text: str):
+        return self.pattern.sub(self._title, text)
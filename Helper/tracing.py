@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+
+# Load environment settings (this module can be imported before the modules that load them)
+load_dotenv()
+
+
+# Local timing spans of the pipeline stages, exported as a Chrome trace (chrome://tracing, Perfetto)
+tracing_enabled = os.getenv("TRACING", "0") == "1"
+trace_dir = "Documents/Traces"
+
+spans = []
+spans_lock = threading.Lock()
+
+# Labels (document, section, criterion) inherited by the spans opened inside another span
+trace_labels = contextvars.ContextVar("trace_labels", default={})
+
+
+# Time a block: with span("evaluate_question", section=part_name, criterion=name): ...
+@contextmanager
+def span(name: str, **labels):
+    if not tracing_enabled:
+        yield
+        return
+
+    labels = {**trace_labels.get(), **{key: value for key, value in labels.items() if value is not None}}
+    token = trace_labels.set(labels)
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - begin
+        trace_labels.reset(token)
+        with spans_lock:
+            spans.append({"name": name, "start": start, "seconds": seconds, "pid": os.getpid(),
+                          "tid": threading.get_ident(), "labels": labels})
+
+
+# Remove and return the spans recorded so far in this process
+def take_spans():
+    with spans_lock:
+        taken = spans[:]
+        spans.clear()
+    return taken
+
+
+def add_spans(recorded: list):
+    with spans_lock:
+        spans.extend(recorded)
+
+
+# Run a function in a worker process under a span and hand its spans back with the result
+def traced_call(name: str, labels: dict, func, *args):
+    with span(name, **labels):
+        result = func(*args)
+    return result, take_spans()
+
+
+def percentile(values: list, fraction: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Count, total, p50, p95 and max seconds per span name
+def summarize(recorded: list):
+    durations = {}
+    for recorded_span in recorded:
+        durations.setdefault(recorded_span["name"], []).append(recorded_span["seconds"])
+    return {name: {"count": len(values), "total": sum(values), "p50": percentile(values, 0.5),
+                   "p95": percentile(values, 0.95), "max": max(values)}
+            for name, values in durations.items()}
+
+
+def export_chrome_trace(recorded: list, path: str):
+    events = [{"name": recorded_span["name"], "cat": "pipeline", "ph": "X",
+               "ts": recorded_span["start"] * 1e6, "dur": recorded_span["seconds"] * 1e6,
+               "pid": recorded_span["pid"], "tid": recorded_span["tid"], "args": recorded_span["labels"]}
+              for recorded_span in recorded]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+# Write the spans of the batch to a trace file, print the summary per stage and the slowest spans
+def report_trace():
+    recorded = take_spans()
+    if not recorded:
+        return None
+
+    path = os.path.join(trace_dir, f"trace_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    export_chrome_trace(recorded, path)
+
+    print(f"[INFO] Trace of {len(recorded)} spans saved to {path}")
+    print(f"[INFO] {'stage':28} {'count':>6} {'total (s)':>10} {'p50 (s)':>9} {'p95 (s)':>9} {'max (s)':>9}")
+    for name, stats in sorted(summarize(recorded).items(), key=lambda item: -item[1]["total"]):
+        print(f"[INFO] {name:28} {stats['count']:6} {stats['total']:10.3f} {stats['p50']:9.3f} "
+              f"{stats['p95']:9.3f} {stats['max']:9.3f}")
+
+    for recorded_span in sorted(recorded, key=lambda recorded_span: -recorded_span["seconds"])[:5]:
+        labels = ", ".join(f"{key}={value}" for key, value in recorded_span["labels"].items())
+        print(f"[INFO] Slow: {recorded_span['name']} {recorded_span['seconds']:.3f}s ({labels})")
+    return path
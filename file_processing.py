@@ -1,8 +1,67 @@
 import re
 import os
-import camelot
+import json
+import time
+import fitz
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from camelot.core import TableList
+from camelot.parsers import Lattice, Stream
+from camelot.utils import get_page_layout, get_rotation, get_text_objects
+from docx import Document as DocxDocument
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 from docx2pdf import convert
+from pypdf import PdfReader, PdfWriter
 from llm_processing import part_titles
+from Helper.cache import DiskCache, cache_key, file_sha256
+from Helper.title_matching import TitleMatcher, title_pattern
+from Helper.tracing import span
+
+
+# Stream settings used for the text extraction (full A4 page as a single table area)
+stream_table_areas = ['0,842,595,0']
+
+# Part titles compiled once: one matcher for stream rows and one to restore spaced out titles
+title_suffix = r"[\s:–-]*$"
+title_matcher = TitleMatcher(part_titles, suffix=title_suffix)
+title_normalizer = TitleMatcher(part_titles)
+
+# Cells starting with "1." to "9." are numbered items
+numbered_item = re.compile(r"[1-9]\.")
+
+# Tables of the most recently parsed PDFs, shared by the stream and lattice steps
+parsed_pdf_cache = OrderedDict()
+parsed_pdf_cache_size = 4
+
+# Seconds spent on the stream and on the lattice tables of the last parse of each PDF (absolute path -> seconds
+# by mode); the stream tables include the page layout, which both modes share
+pdf_parse_seconds = {}
+
+# Text extraction backend: "pymupdf" reads the text layer and falls back to "camelot" when it is not good enough
+extractor_backend = os.getenv("EXTRACTOR_BACKEND", "pymupdf")
+fallback_backend = "camelot"
+row_tolerance = 3  # Text lines whose vertical centres are this close (in points) belong to the same row
+
+# DOCX reader: "native" walks the document with python-docx, "pdf" converts it with docx2pdf (needs Word)
+docx_reader = os.getenv("DOCX_READER", "native")
+
+# Intermediate texts (stream, lattice, extracted section, final) are only written to disk when enabled
+debug_artifacts = os.getenv("DEBUG_ARTIFACTS", "0") == "1"
+debug_writer = None
+debug_writes = []
+
+# Backend used for each extracted file (absolute path -> report)
+extraction_reports = {}
+
+# Content addressed cache of extracted text (bump the version whenever the extraction output changes)
+extractor_version = "2"
+extraction_cache_path = "Documents/Cache/extraction.sqlite"
+extraction_cache_max_bytes = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+extraction_cache = None
+file_digests = {}
 
 
 # Ensure directories exist
@@ -17,34 +76,57 @@ def check_directory():
         os.makedirs("Documents/AlreadyRead/Debug")
 
 
-# Read text from a PDF
-def read_pdf_text(pdfPath: str, is_rubric_path=False):
-    print(f"read_pdf_text is called for: {pdfPath}")
+# Open the extraction cache lazily, so a worker process opens its own connection on first use
+def get_extraction_cache():
+    global extraction_cache
+    if extraction_cache is None:
+        extraction_cache = DiskCache(extraction_cache_path, max_bytes=extraction_cache_max_bytes)
+    return extraction_cache
+
 
-    pdfText = ""
-    path = os.path.split(pdfPath)
-    tail = path[1]
-    fileName, extension = tail.rsplit(".", 1)
+# Close the connection of this process (reopened on the next use). Call it before starting worker
+# processes: an SQLite connection must not be used across fork(), so none may be inherited
+def close_extraction_cache():
+    global extraction_cache
+    if extraction_cache is not None:
+        extraction_cache.close()
+        extraction_cache = None
 
-    # Set the appropriate output directory
-    output_folder = "Documents/AlreadyRead"
 
-    # When never processed the PDF content before
-    if not os.path.exists(f"{output_folder}/{fileName}.txt"):
-        pdf_path = pdfPath
+# Cache key for one extraction stage of a file: its SHA-256 plus the extractor version and settings
+def extraction_cache_key(file_path: str, stage: str):
+    stat = os.stat(file_path)
+    digest_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    if digest_key not in file_digests:
+        file_digests[digest_key] = file_sha256(file_path)
 
-        # Extract data with camelot
-        camelot_text = extract_data(pdf_path)
+    settings = {"stage": stage, "backend": extractor_backend, "stream_table_areas": stream_table_areas,
+                "part_titles": part_titles}
+    return cache_key(file_digests[digest_key], extractor_version, settings)
 
-        pdfText = camelot_text
 
-        # Save results to txt file
-        with open(f"{output_folder}/Debug/{fileName}_stream.txt", "w", encoding='utf-8-sig') as file:
-            file.write(pdfText)
+# Read text from a PDF (use_cache=False for files whose bytes never repeat, like converted DOCX files)
+def read_pdf_text(pdfPath: str, is_rubric_path=False, use_cache=True):
+    print(f"read_pdf_text is called for: {pdfPath}")
+
+    # Reuse the text of any identical file extracted before, whatever its name
+    cache = get_extraction_cache() if use_cache else None
+    key = extraction_cache_key(pdfPath, "stream") if use_cache else None
+    cached = cache.get(key) if use_cache else None
+
+    if cached is None:
+        # Extract data with the configured backend (camelot when the text layer is not good enough)
+        with span("stream_extraction", document=os.path.basename(pdfPath)):
+            pdfText, report = extract_text_with_backend(pdfPath)
+        if use_cache:
+            cache.set(key, json.dumps({"text": pdfText, "report": report}))
     else:
-        # Read already saved results
-        with open(f"{output_folder}/Debug/{fileName}_stream.txt", "r", encoding='utf-8-sig') as file:
-            pdfText = file.read()
+        print(f"[INFO] Extraction cache hit for: {pdfPath}")
+        cached = json.loads(cached)
+        pdfText, report = cached["text"], cached["report"]
+
+    extraction_reports[os.path.abspath(pdfPath)] = report
+    save_debug_text(pdfPath, pdfText, "stream")
 
     return pdfText
 
@@ -61,24 +143,11 @@ def convert_docx_to_pdf(docxPath: str, is_rubric_path=False):
         convert(docxPath, local_pdf_path)
         print(f"[INFO] DOCX converted to PDF: {local_pdf_path}")
 
-        # Extract the filename without extension
-        fileName = os.path.basename(docxPath).replace(".docx", "")
+        # Read the PDF text using the existing method; the converted PDF differs on every conversion,
+        # so it is not cached (process_docx_with_combined_modes caches the result on the DOCX bytes)
+        pdfText = read_pdf_text(local_pdf_path, is_rubric_path=is_rubric_path, use_cache=False)
 
-        # Set the appropriate output directory
-        output_folder = "Documents/AlreadyRead"
-
-        # Check if the corresponding txt file already exists
-        if not os.path.exists(f"{output_folder}/{fileName}.txt"):
-            # Read the PDF text using the existing method
-            pdfText = read_pdf_text(local_pdf_path, is_rubric_path=is_rubric_path)
-
-            # Save the extracted text to a .txt file
-            with open(f"{output_folder}/Debug/{fileName}_stream.txt", "w", encoding='utf-8-sig') as file:
-                file.write(pdfText)
-        else:
-            # If the txt file already exists, just read it
-            with open(f"{output_folder}/Debug/{fileName}_stream.txt", "r", encoding='utf-8-sig') as file:
-                pdfText = file.read()
+        save_debug_text(docxPath, pdfText, "stream")
 
         # Return the extracted text and the converted PDF path
         return pdfText, local_pdf_path
@@ -88,29 +157,105 @@ def convert_docx_to_pdf(docxPath: str, is_rubric_path=False):
         return None, None  # Return None if an error occurs
 
 
+# Yield the paragraphs and tables of a DOCX body in document order
+def iter_docx_blocks(document):
+    for child in document.element.body.iterchildren():
+        if child.tag == qn("w:p"):
+            yield Paragraph(child, document)
+        elif child.tag == qn("w:tbl"):
+            yield Table(child, document)
+
+
+# Rows of a DOCX table joined like lattice rows (merged cells are only kept once)
+def docx_table_rows(table):
+    for row in table.rows:
+        cells = []
+        seen = set()
+        for cell in row.cells:
+            if cell._tc in seen:
+                continue
+            seen.add(cell._tc)
+            cells.append(cell.text.strip())
+        yield " ".join(cells)
+
+
+# List items carry their bullet in the numbering definition (of the paragraph or its style), not in the text
+def is_list_paragraph(paragraph):
+    if paragraph._p.pPr is not None and paragraph._p.pPr.numPr is not None:
+        return True
+
+    style = paragraph.style
+    while style is not None:
+        if style.element.pPr is not None and style.element.pPr.numPr is not None:
+            return True
+        style = style.base_style
+    return False
+
+
+# Read a DOCX directly: paragraphs and table rows in order, formatted like the PDF text
+def extract_docx_text(docxPath: str):
+    document = DocxDocument(docxPath)
+    formatted_parts = []
+
+    for block in iter_docx_blocks(document):
+        if isinstance(block, Paragraph):
+            rows = [block.text.strip()]
+            if rows[0] and is_list_paragraph(block):
+                rows = [f"● {rows[0]}"]
+        else:
+            rows = list(docx_table_rows(block))
+
+        for row_str in rows:
+            # If any keyword from the list appears at the beginning of the row, add a line break
+            if title_matcher.search(row_str):
+                formatted_parts.append("\n\n")
+            formatted_parts.append(row_str + "\n")
+
+        if isinstance(block, Table):
+            formatted_parts.append("\n\n")
+
+    formatted_data = format_bullet_points("".join(formatted_parts))
+    formatted_data = clean_tabs_and_titles(formatted_data)
+
+    return formatted_data
+
+
+# Read text from a DOCX without converting it to PDF
+def read_docx_text(docxPath: str):
+    print(f"read_docx_text is called for: {docxPath}")
+
+    try:
+        cache = get_extraction_cache()
+        key = extraction_cache_key(docxPath, "docx_native")
+        docxText = cache.get(key)
+
+        if docxText is None:
+            with span("docx_extraction", document=os.path.basename(docxPath)):
+                docxText = extract_docx_text(docxPath)
+            cache.set(key, docxText)
+        else:
+            print(f"[INFO] Extraction cache hit for: {docxPath}")
+
+        extraction_reports[os.path.abspath(docxPath)] = {"backend": "python-docx", "fallback": False, "reason": ""}
+        save_debug_text(docxPath, docxText)
+        return docxText
+
+    except Exception as e:
+        print(f"[ERROR] An error occurred while reading the file: {e}")
+        return None
+
+
 # Remove tabs and normalize spaces (only for titles defined in part_titles)
 def clean_tabs_and_titles(text):
     text = text.replace('\t', ' ')
 
-    for title in part_titles:
-        # Remove all spaces within the title
-        compressed_title = re.sub(r'\s+', '', title)
-
-        # Replace occurrences of the compressed title (with spaces in between) with the original title
-        pattern = re.compile(r'(\s*)'.join(list(compressed_title)), re.IGNORECASE)
-        text = pattern.sub(title, text)
-
-    return text
+    # Replace occurrences of the titles (with spaces in between characters) with the original titles
+    return title_normalizer.normalize(text)
 
 
 def match_title_with_variations(line, title):
-    # Generate a regex pattern to allow optional spaces or special characters between each character
-    regex_title = r'[\s]*'.join(re.escape(char) for char in title if char != " ")
-    
-    # Exception handling: allow spaces, dashes (-), and colons (:) after the title
-    pattern = fr"{regex_title}[\s:–-]*$"
-    
-    return re.search(pattern, line, flags=re.IGNORECASE)
+    # Allow optional spaces between each character, and spaces, dashes (-) and colons (:) after the title
+    return title_pattern(title, suffix=title_suffix).search(line)
 
 
 # Bullet point handling and line break management
@@ -150,84 +295,304 @@ def format_bullet_points(text):
     return "\n".join(formatted_lines)
 
 
+# Same page attributes camelot's BaseParser._generate_layout sets, built from an already computed layout
+def build_page_layout(filename, layout, dimensions):
+    rootname, _ = os.path.splitext(filename)
+    return {
+        "filename": filename,
+        "layout_kwargs": {},
+        "layout": layout,
+        "dimensions": dimensions,
+        "images": get_text_objects(layout, ltype="image"),
+        "horizontal_text": get_text_objects(layout, ltype="horizontal_text"),
+        "vertical_text": get_text_objects(layout, ltype="vertical_text"),
+        "pdf_width": dimensions[0],
+        "pdf_height": dimensions[1],
+        "rootname": rootname,
+        "imagename": "".join([rootname, ".png"]),
+    }
+
+
+# Reuse the pdfminer layout of a page instead of letting every parser analyse it again
+class SharedLayoutMixin:
+    def __init__(self, page_layouts: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.page_layouts = page_layouts
+
+    def _generate_layout(self, filename, layout_kwargs):
+        if filename not in self.page_layouts:
+            self.page_layouts[filename] = build_page_layout(filename, *get_page_layout(filename, **layout_kwargs))
+
+        for attr, value in self.page_layouts[filename].items():
+            # Copy the text object lists so one parser cannot alter what the other one sees
+            setattr(self, attr, list(value) if isinstance(value, list) else value)
+
+
+class SharedLayoutStream(SharedLayoutMixin, Stream):
+    pass
+
+
+class SharedLayoutLattice(SharedLayoutMixin, Lattice):
+    pass
+
+
+# Write one page to its own PDF like camelot's PDFHandler._save_page, keeping the layout it computes
+def save_pdf_page(reader, page, tempdir):
+    page_path = os.path.join(tempdir, f"page-{page}.pdf")
+    writer = PdfWriter()
+    writer.add_page(reader.pages[page - 1])
+    with open(page_path, "wb") as file:
+        writer.write(file)
+
+    # The layout is needed anyway to detect rotated pages
+    layout, dimensions = get_page_layout(page_path)
+    rotation = get_rotation(get_text_objects(layout, ltype="char"),
+                            get_text_objects(layout, ltype="horizontal_text"),
+                            get_text_objects(layout, ltype="vertical_text"))
+    if rotation == "":
+        return page_path, build_page_layout(page_path, layout, dimensions)
+
+    # Rotated pages are straightened first; the parsers lay out the rotated page themselves
+    rotated_page = PdfReader(page_path, strict=False).pages[0]
+    rotated_page.rotate(90 if rotation == "anticlockwise" else -90)
+    writer = PdfWriter()
+    writer.add_page(rotated_page)
+    with open(page_path, "wb") as file:
+        writer.write(file)
+    return page_path, None
+
+
+# Parse a PDF once: every page is split and laid out a single time for both stream and lattice tables
+def parse_pdf_tables(file_path):
+    reader = PdfReader(file_path, strict=False)
+    if reader.is_encrypted:
+        reader.decrypt("")
+
+    page_layouts = {}
+    stream_parser = SharedLayoutStream(page_layouts, table_areas=stream_table_areas)
+    lattice_parser = SharedLayoutLattice(page_layouts)
+
+    stream_tables = []
+    lattice_tables = []
+    lattice_error = None
+    seconds = {"stream": 0.0, "lattice": 0.0}
+    document = os.path.basename(file_path)
+
+    with TemporaryDirectory() as tempdir:
+        for page in range(1, len(reader.pages) + 1):
+            page_path, page_layout = save_pdf_page(reader, page, tempdir)
+            if page_layout:
+                page_layouts[page_path] = page_layout
+
+            start = time.perf_counter()
+            with span("stream_tables", document=document, page=page):
+                stream_tables.extend(stream_parser.extract_tables(page_path, suppress_stdout=True))
+            seconds["stream"] += time.perf_counter() - start
+
+            # Lattice needs Ghostscript; keep the stream tables even when it is unavailable
+            if lattice_error is None:
+                start = time.perf_counter()
+                try:
+                    with span("lattice_tables", document=document, page=page):
+                        lattice_tables.extend(lattice_parser.extract_tables(page_path, suppress_stdout=True))
+                except Exception as e:
+                    lattice_error = e
+                seconds["lattice"] += time.perf_counter() - start
+
+            # The layout of a page is not needed once both parsers are done with it
+            page_layouts.pop(page_path, None)
+
+    pdf_parse_seconds[os.path.abspath(file_path)] = seconds
+    return TableList(sorted(stream_tables)), TableList(sorted(lattice_tables)), lattice_error
+
+
+# Return the parsed tables of a PDF, parsing it only if it changed since the last call
+def get_parsed_pdf(file_path):
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+    if key not in parsed_pdf_cache:
+        parsed_pdf_cache[key] = parse_pdf_tables(file_path)
+        while len(parsed_pdf_cache) > parsed_pdf_cache_size:
+            parsed_pdf_cache.popitem(last=False)
+
+    return parsed_pdf_cache[key]
+
+
+# Forget the parsed tables of a PDF once every extraction step used them
+def release_parsed_pdf(file_path):
+    path = os.path.abspath(file_path)
+    for key in [key for key in parsed_pdf_cache if key[0] == path]:
+        del parsed_pdf_cache[key]
+
+
+# Format the sub items of a multi-line or numbered cell
+def format_sub_items(cell_content: str, width: int):
+    sub_cells = []
+    for sub_item in cell_content.split('\n'):
+        # If it starts with a number, add exactly one space after the number
+        if numbered_item.match(sub_item.strip()):
+            sub_cells.append(sub_item.strip().replace(".", ". ", 1))
+        else:
+            sub_cells.append(sub_item.ljust(width))
+    return "".join(sub_cells)
+
+
+# Format the rows of a table as aligned text, one column at a time
+def format_table_rows(df):
+    if df.empty:
+        return []
+
+    columns = []
+    for col in df.columns:
+        values = df[col].astype(str)
+
+        # Column width: longest raw cell plus the header width, and two spaces of padding
+        width = int(values.str.len().max()) + len(str(col)) + 2
+        content = values.str.strip()
+        formatted = content.str.ljust(width)
+
+        # If there are line breaks within the cell or it starts with a number, treat it as a sub-table
+        sub_table = content.str.contains('\n', regex=False) | content.str.match(numbered_item.pattern)
+        if sub_table.any():
+            formatted.loc[sub_table] = content[sub_table].map(lambda cell: format_sub_items(cell, width))
+
+        columns.append(formatted)
+
+    # Combine every row into a single string
+    rows = columns[0].str.cat(columns[1:]) if len(columns) > 1 else columns[0]
+    return rows.str.rstrip().tolist()
+
+
 # Extract and format table data using Camelot
 def extract_data(file_path):
-    tables = camelot.read_pdf(file_path, flavor='stream', pages='1-end', table_areas=['0,842,595,0'])
-
-    formatted_data = ""
-
-    for idx, table in enumerate(tables):
-        df = table.df
-
-        # Calculate the maximum width for each column
-        max_col_widths = [max(df[col].apply(lambda x: len(str(x))) + [len(str(col))]) for col in df.columns]
-
-        # Retrieve and format data from each row
-        for _, row in df.iterrows():
-            row_cells = []
-            for idx, cell in enumerate(row):
-                cell_content = str(cell).strip()
-
-                # If there are line breaks within the cell or it starts with a number, treat it as a sub-table
-                if '\n' in cell_content or any(cell_content.strip().startswith(str(i) + ".") for i in range(1, 10)):
-                    sub_items = cell_content.split('\n')
-                    for sub_item in sub_items:
-                        # If it starts with a number, add exactly one space after the number
-                        if any(sub_item.strip().startswith(str(i) + ".") for i in range(1, 10)):
-                            formatted_sub_item = sub_item.strip().replace(".", ". ", 1)
-                            row_cells.append(formatted_sub_item)
-                        else:
-                            row_cells.append(sub_item.ljust(max_col_widths[idx] + 2))
-                else:
-                    row_cells.append(cell_content.ljust(max_col_widths[idx] + 2))
-
-            # Combine the current row into a single string
-            row_str = "".join(row_cells).rstrip()
+    tables, _, _ = get_parsed_pdf(file_path)
 
+    formatted_parts = []
+    for table in tables:
+        for row_str in format_table_rows(table.df):
             # If any keyword from the list appears at the beginning of the row, add a line break
-            if any(match_title_with_variations(row_str, title) for title in part_titles):
-    
-                formatted_data += "\n\n"
-
-            formatted_data += row_str + "\n"
+            if title_matcher.search(row_str):
+                formatted_parts.append("\n\n")
+            formatted_parts.append(row_str + "\n")
 
         # Add a blank line between tables for better readability
-        formatted_data += "\n\n"
+        formatted_parts.append("\n\n")
 
-    formatted_data = format_bullet_points(formatted_data)
+    formatted_data = format_bullet_points("".join(formatted_parts))
     formatted_data = clean_tabs_and_titles(formatted_data)
 
     return formatted_data
 
 
-# Extract and format table data using Camelot (lattice mode)
-def extract_lattice_section(file_path):
+# Group the text lines of a page into rows (like camelot stream) and join the cells of a row left to right
+def page_text_rows(page):
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                x0, y0, x1, y1 = line["bbox"]
+                lines.append(((y0 + y1) / 2, x0, text))
+
+    rows = []
+    for y, x, text in sorted(lines):
+        if rows and y - rows[-1][0] <= row_tolerance:
+            rows[-1][1].append((x, text))
+        else:
+            rows.append([y, [(x, text)]])
+
+    # Numbered cells get exactly one space after the number, as in the camelot formatter
+    return ["  ".join(text.replace(".", ". ", 1) if numbered_item.match(text) else text
+                      for _, text in sorted(cells)) for _, cells in rows]
+
+
+# Fast path: read the PDF text layer with PyMuPDF. Returns the text, or None and why it is not usable
+def extract_text_pymupdf(file_path):
+    formatted_parts = []
+    title_found = False
+
+    with fitz.open(file_path) as document:
+        for page in document:
+            for row_str in page_text_rows(page):
+                # If any keyword from the list appears at the beginning of the row, add a line break
+                if title_matcher.search(row_str):
+                    title_found = True
+                    formatted_parts.append("\n\n")
+                formatted_parts.append(row_str + "\n")
+            formatted_parts.append("\n\n")
+
+            # A ruled "Project Overview" table only reads correctly through the lattice replacement
+            if page.search_for("Problem Summary") and page.find_tables().tables:
+                return None, "Project Overview table needs lattice extraction"
+
+    if not title_found:
+        return None, "no section titles found"
+
+    formatted_data = format_bullet_points("".join(formatted_parts))
+    formatted_data = clean_tabs_and_titles(formatted_data)
+
+    return formatted_data, None
+
+
+# Slow path: camelot stream tables, later completed by the lattice replacement
+def extract_text_camelot(file_path):
+    return extract_data(file_path), None
+
+
+extractor_backends = {
+    "pymupdf": extract_text_pymupdf,
+    "camelot": extract_text_camelot,
+}
+
+
+# Extract with the configured backend, falling back to camelot when its quality checks fail
+def extract_text_with_backend(file_path):
+    backend = extractor_backend if extractor_backend in extractor_backends else fallback_backend
+
     try:
-        tables = camelot.read_pdf(file_path, flavor="lattice", pages="1-end")
-        extracted_text = ""
+        text, failure = extractor_backends[backend](file_path)
+    except Exception as e:
+        text, failure = None, f"{backend} failed: {e}"
+
+    if failure is None:
+        report = {"backend": backend, "fallback": False, "reason": ""}
+    else:
+        print(f"[WARNING] {backend} extraction rejected for {file_path} ({failure}), falling back to {fallback_backend}")
+        text, _ = extractor_backends[fallback_backend](file_path)
+        report = {"backend": fallback_backend, "fallback": True, "reason": failure}
+
+    print(f"[INFO] Extraction backend for {file_path}: {report['backend']}")
+    return text, report
 
-        for table in tables:
-            extracted_text += "\n".join([" ".join(row) for row in table.df.values]) + "\n\n"
 
-        # output_folder = "Documents/AlreadyRead/Debug"
-        output_folder = "Documents/AlreadyRead"
-        base_name = os.path.basename(file_path).replace(".pdf", "_lattice.txt")
-        lattice_output_path = os.path.join(output_folder + "/Debug", base_name)
+# Backend report of a file extracted in this process
+def get_extraction_report(file_path):
+    return extraction_reports.get(os.path.abspath(file_path), {"backend": fallback_backend, "fallback": False,
+                                                               "reason": ""})
+
+
+# Extract and format table data using Camelot (lattice mode)
+def extract_lattice_section(file_path):
+    try:
+        _, tables, lattice_error = get_parsed_pdf(file_path)
+        release_parsed_pdf(file_path)
+        if lattice_error is not None:
+            raise lattice_error
 
-        with open(lattice_output_path, "w", encoding='utf-8-sig') as lattice_file:
-            lattice_file.write(extracted_text)
+        extracted_text = "".join("\n".join([" ".join(row) for row in table.df.values]) + "\n\n"
+                                 for table in tables)
 
-        print(f"[INFO] Lattice section saved to {lattice_output_path}")
-        return lattice_output_path
+        save_debug_text(file_path, extracted_text, "lattice")
+        return extracted_text
     except Exception as e:
         print(f"[ERROR] Lattice extraction failed: {e}")
         return None
 
 
-def extract_section_from_lattice(lattice_file, start_keyword):
+def extract_section_from_lattice(lattice_text, start_keyword, file_path=None):
     try:
-        with open(lattice_file, "r", encoding='utf-8-sig') as file:
-            content = file.readlines()  # Read file line by line
+        content = lattice_text.splitlines(keepends=True)  # Split text line by line
 
         # Find the start of the section
         start_index = -1
@@ -253,62 +618,36 @@ def extract_section_from_lattice(lattice_file, start_keyword):
             print("[WARNING] Unable to locate the start or end indices for extraction.")
             extracted_text = ""
 
-        # Save the extracted section
-        output_folder = "Documents/AlreadyRead/Debug"
-        base_name = os.path.basename(lattice_file).replace("_lattice.txt", "_lattice_extracted.txt")
-        output_extracted_file = os.path.join(output_folder, base_name)
-
-        with open(output_extracted_file, "w", encoding='utf-8-sig') as extracted_file:
-            extracted_file.write(extracted_text)
-
-        print(f"[INFO] Extracted section saved to {output_extracted_file}")
-        return output_extracted_file
+        if file_path:
+            save_debug_text(file_path, extracted_text, "lattice_extracted")
+        return extracted_text
     except Exception as e:
         print(f"[ERROR] Failed to extract section: {e}")
         return None
     
 
-# Replace "Project Overview" section in stream file
-def replace_stream_content(stream_file, extracted_file, output_file):
-    try:
-        with open(stream_file, "r", encoding='utf-8-sig') as stream:
-            stream_content = stream.read()
-
-        with open(extracted_file, "r", encoding='utf-8-sig') as extracted:
-            extracted_content = extracted.read()
-
-        # Find and replace "Project Overview" section
-        pattern = r"(Project\s*Overview\s*[:\n]+)(.*?)(\n\nTimeline|Timeline\s*:|Timeline\s+\n)"
-        updated_content = re.sub(
-            pattern,
-            rf"\1{extracted_content}\n\n\3",
-            stream_content,
-            flags=re.DOTALL,
-        )
-
-        if updated_content != stream_content:
-            print("[INFO] Content replacement succeed.")
-        else:
-            print("[WARNING] Content replacement failed. Check the pattern or input content.")
-
-        output_folder = "Documents/AlreadyRead"
-        final_file_path = os.path.join(output_folder, os.path.basename(output_file))
+# Replace "Project Overview" section in stream text
+def replace_stream_content(stream_content, extracted_content):
+    # Find and replace "Project Overview" section
+    pattern = r"(Project\s*Overview\s*[:\n]+)(.*?)(\n\nTimeline|Timeline\s*:|Timeline\s+\n)"
+    updated_content = re.sub(
+        pattern,
+        lambda match: f"{match.group(1)}{extracted_content}\n\n{match.group(3)}",
+        stream_content,
+        flags=re.DOTALL,
+    )
 
-        with open(final_file_path, "w", encoding='utf-8-sig') as final_file:
-            final_file.write(updated_content)
+    if updated_content != stream_content:
+        print("[INFO] Content replacement succeed.")
+    else:
+        print("[WARNING] Content replacement failed. Check the pattern or input content.")
 
-        print(f"[INFO] Final file saved to {final_file_path}")
-    except Exception as e:
-        print(f"[ERROR] Failed to replace stream content: {e}")
+    return updated_content
 
 
-# Process lattice and stream files
-def process_pdf_with_combined_modes(input_file):
+# Process lattice and stream text, returning the final text of the document
+def process_pdf_with_combined_modes(input_file, stream_text=None, use_cache=True):
     print(f"[INFO] process_pdf_with_combined_modes is called for: {input_file}")
-    base_name = os.path.basename(input_file).replace(".pdf", "")
-    stream_output = f"Documents/AlreadyRead/Debug/{base_name}_stream.txt"
-    lattice_output_path = f"Documents/AlreadyRead/Debug/{base_name}_lattice.txt"
-    final_output = f"Documents/AlreadyRead/{base_name}.txt"
 
     # Debugging
     if not os.path.exists(input_file):
@@ -317,43 +656,100 @@ def process_pdf_with_combined_modes(input_file):
 
     print(f"[INFO] Processing PDF: {input_file}")
 
-    # Step 1: Verify the existence of the stream file
-    if not os.path.exists(stream_output):
-        print(f"[ERROR] Stream file not found: {stream_output}")
+    # Step 1: Get the stream text (from the extraction cache when the caller does not pass it)
+    if stream_text is None:
+        stream_text = read_pdf_text(input_file)
+    if not stream_text:
+        print(f"[ERROR] Stream text not found: {input_file}")
+        return None
+
+    # Reuse the combined output of an identical file processed before
+    cache = get_extraction_cache()
+    key = extraction_cache_key(input_file, "combined") if use_cache else None
+    final_text = cache.get(key) if use_cache else None
+    if final_text is not None:
+        print(f"[INFO] Extraction cache hit for combined output: {input_file}")
+        save_debug_text(input_file, final_text)
+        return final_text
+
+    # Text layer extraction already reads the Project Overview correctly, so no lattice pass is needed
+    final_text = stream_text
+    if get_extraction_report(input_file)["backend"] == fallback_backend:
+        # Step 2: Extract Project Overview using lattice mode (the lattice tables were parsed along with the
+        # stream tables, in the lattice_tables spans; this span only covers turning them into text)
+        with span("lattice_text", document=os.path.basename(input_file)):
+            lattice_text = extract_lattice_section(input_file)
+
+        # Step 3: Extract specific section and replace in stream text
+        with span("section_splice", document=os.path.basename(input_file)):
+            extracted_text = None
+            if lattice_text is not None:
+                extracted_text = extract_section_from_lattice(lattice_text, "Problem Summary", file_path=input_file)
+
+            if extracted_text is not None:
+                final_text = replace_stream_content(stream_text, extracted_text)
+            else:
+                print("[WARNING] No section extracted from lattice text.")
+
+    if use_cache:
+        cache.set(key, final_text)
+    save_debug_text(input_file, final_text)
+    return final_text
+
+
+# Text of a DOCX read through a PDF conversion (DOCX_READER=pdf). The converted PDF differs on every
+# conversion, so the result is cached on the DOCX bytes and the conversion only runs on a cache miss
+def process_docx_with_combined_modes(docxPath: str):
+    cache = get_extraction_cache()
+    key = extraction_cache_key(docxPath, "docx_combined")
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"[INFO] Extraction cache hit for: {docxPath}")
+        cached = json.loads(cached)
+        extraction_reports[os.path.abspath(docxPath)] = cached["report"]
+        save_debug_text(docxPath, cached["text"])
+        return cached["text"]
+
+    streamContent, pdf_path = convert_docx_to_pdf(docxPath)
+    if not streamContent or not pdf_path or not os.path.exists(pdf_path):
+        print(f"[ERROR] Failed to convert DOCX: {docxPath}")
         return None
 
-    # Step 2: Extract Project Overview using lattice mode
+    final_text = process_pdf_with_combined_modes(pdf_path, streamContent, use_cache=False)
+    if final_text:
+        report = get_extraction_report(pdf_path)
+        extraction_reports[os.path.abspath(docxPath)] = report
+        cache.set(key, json.dumps({"text": final_text, "report": report}))
+    return final_text
+
+
+# Write debug text in the background so the extraction never waits on (network) storage
+def write_debug_text(path, content):
     try:
-        lattice_output_path = extract_lattice_section(input_file)  # Extract using lattice
-        if lattice_output_path and os.path.exists(lattice_output_path):
-            print(f"[INFO] Lattice file found: {lattice_output_path}")
-            with open(lattice_output_path, "r", encoding='utf-8-sig') as lattice_file:
-                lattice_text = lattice_file.read()
-            save_debug_text(input_file, lattice_text, "lattice")
-        else:
-            print("[WARNING] Lattice file not found.")
-            lattice_text = ""
+        with open(path, "w", encoding='utf-8-sig') as file:
+            file.write(content)
     except Exception as e:
-        print(f"[ERROR] Lattice extraction failed: {e}")
-        lattice_text = ""
+        print(f"[ERROR] Failed to write debug artifact {path}: {e}")
 
-    # Step 3: Extract specific section and replace in stream file
-    extracted_file = extract_section_from_lattice(
-        lattice_file=lattice_output_path,
-        start_keyword="Problem Summary"
-    )
 
-    if extracted_file:
-        replace_stream_content(stream_output, extracted_file, final_output)
+# Save extracted text to file when debug artifacts are enabled (no suffix: the final text)
+def save_debug_text(file_path, content, suffix=None):
+    global debug_writer
+    if not debug_artifacts or content is None:
+        return
+
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    if suffix:
+        path = os.path.join("Documents/AlreadyRead/Debug", f"{base_name}_{suffix}.txt")
     else:
-        print("[WARNING] No section extracted from lattice file.")
+        path = os.path.join("Documents/AlreadyRead", f"{base_name}.txt")
 
-    return final_output
+    if debug_writer is None:
+        debug_writer = ThreadPoolExecutor(max_workers=1)
+    debug_writes.append(debug_writer.submit(write_debug_text, path, content))
 
-# Save extracted text to file
-def save_debug_text(file_path, content, suffix):
-    output_folder = "Documents/AlreadyRead/Debug"
-    file_name = os.path.basename(file_path).replace(".pdf", f"_{suffix}.txt")
 
-    with open(os.path.join(output_folder, file_name), "w", encoding='utf-8-sig') as file:
-        file.write(content)
+# Wait for the pending debug artifact writes (call before a worker process returns)
+def flush_debug_text():
+    while debug_writes:
+        debug_writes.pop().result()
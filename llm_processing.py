@@ -1,23 +1,188 @@
-import re
 import os
+import copy
 import yaml
-import json
+import time
+import asyncio
+import hashlib
+import threading
+import contextvars
 from string import Template
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
 from Helper.logging import langsmith
+from Helper.cache import DiskCache, cache_key
+from Helper.title_matching import TitleMatcher
+from Helper.llm_pool import get_chain, get_chain_variant, resilient_call, prompt_affinity, llm_record_path
+from Helper.json_parsing import parse_llm_json
+from Helper.prescoring import prescore
+from Helper.tracing import span
 from langchain.docstore.document import Document
-from langchain_community.chat_models import ChatOllama
 from langchain_community.callbacks import get_openai_callback
-from langchain.chains.question_answering import load_qa_chain
 
 
+# Load environment settings before any of them is read
+load_dotenv()
+
 # Global variables
 output_dir = "chunk"
-rubric_file = "Prompts/Rubric.yaml" # Change file as you want
+# Write the parts of every document to chunk/<document hash>/ for debugging
+chunk_dumps = os.getenv("CHUNK_DUMPS", "0") == "1"
+llm_model = os.getenv("LLM_MODEL", "llama3")
+rubric_file = os.getenv("RUBRIC_FILE", "Prompts/Rubric.yaml") # Change file as you want
 part_titles = ["Project Description / Purpose", "Project Overview", 
                "Timeline", "Project Scope", "Project Team"]
 
-load_dotenv()
+# Part title matchers, compiled once and shared by every document
+description_title = "Project Description / Purpose"
+description_matcher = TitleMatcher([description_title], words=True, suffix=r"[\s:]*$")
+section_title_matcher = TitleMatcher([title for title in part_titles if title != description_title],
+                                     words=True, suffix=r"[\s:]*$")
+
+# Maximum number of LLM calls in flight at once in the async evaluation (shared across documents)
+llm_concurrency = int(os.getenv("LLM_CONCURRENCY", "1"))
+
+# Ask all criteria of a section in one prompt; criteria missing from the answer are asked one by one
+section_batch_mode = os.getenv("SECTION_BATCH_MODE", "0") == "1"
+section_batch_stats = {}
+section_batch_lock = threading.Lock()
+
+# Prompt layout: classic (criterion before the input) or prefix (shared text first, criterion last)
+prompt_layout = os.getenv("PROMPT_LAYOUT", "classic")
+
+# Constrain the answer format: off, json (Ollama JSON mode) or schema (JSON schema of the criteria asked)
+json_output_mode = os.getenv("JSON_OUTPUT", "off")
+json_parse_stats = {}
+json_parse_lock = threading.Lock()
+
+# Token budget of one LLM call (estimated prompt tokens, 0 for no limit): longer section inputs are
+# evaluated in chunks and the chunk scores merged
+token_budget = int(os.getenv("TOKEN_BUDGET", "0"))
+# Smallest input chunk worth a call; a prompt leaving less room than this is sent unchunked instead
+min_chunk_tokens = 200
+budget_warnings = set()
+
+# Token and latency accounting of the LLM calls, for the whole batch and for the current document
+token_usage_stats = {}
+token_usage_lock = threading.Lock()
+document_usage = contextvars.ContextVar("document_usage", default=None)
+
+# Settle clear-cut criteria with the rules of Helper/prescoring.py before asking the LLM
+prescoring_enabled = os.getenv("PRESCORING", "0") == "1"
+
+# Evaluations of the current batch by fingerprint (model settings, criterion prompt and input text), so that
+# identical sections within a document or across the batch are asked once and the answer shared
+evaluation_memo = {}
+dedup_stats = {}
+dedup_lock = threading.Lock()
+empty_section_explanation = "The section is empty, so the criterion is not met."
+
+# Score of a criterion the LLM could not evaluate (call failed after its retries, or no readable answer);
+# the row stays in the results with the reason as its explanation
+failed_score = "FAILED"
+
+# Cache of LLM answers keyed by model, model parameters and the rendered prompt. Recording (LLM_RECORD) turns it
+# off: cached answers never reach the server, so they would be missing from the recording
+llm_cache_enabled = os.getenv("LLM_CACHE", "1") == "1" and not llm_record_path
+llm_cache_path = "Documents/Cache/llm_responses.sqlite"
+llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+llm_cache_max_age = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 24 * 60 * 60
+llm_cache = None
+
+
+# Open the LLM response cache on first use
+def get_llm_cache():
+    global llm_cache
+    if llm_cache is None:
+        llm_cache = DiskCache(llm_cache_path, max_bytes=llm_cache_max_bytes, max_age=llm_cache_max_age)
+    return llm_cache
+
+
+# Cache key of a chain call: model class and parameters plus a hash of the prompt and the document text
+def llm_cache_key(chain, prompt: str, document_text: str):
+    llm = chain.llm_chain.llm
+    settings = {"llm": type(llm).__name__, "params": dict(llm._identifying_params),
+                "chain_prompt": str(chain.llm_chain.prompt)}
+    prompt_hash = hashlib.sha256(f"{prompt}\0{document_text}".encode("utf-8")).hexdigest()
+    return cache_key(prompt_hash, "1", settings)
+
+
+# Ask the chain (with the timeout, retries and hedging of the pool) and account for the tokens and time of the call.
+# Calls on the same section input share an affinity key, so the router keeps them on the server that has it cached
+def call_chain(chain, prompt: str, document_text: str):
+    start = time.perf_counter()
+    token = prompt_affinity.set(hashlib.sha256(document_text.encode("utf-8")).hexdigest())
+    try:
+        with span("llm_call"), get_openai_callback() as callback:
+            answer = resilient_call(chain.llm_chain.llm.pool_key, chain.run,
+                                    input_documents=[Document(page_content=document_text)], question=prompt)
+    except Exception:
+        # A call that failed or timed out still took its time (and its retries)
+        add_token_usage(calls=1, failed_calls=1, seconds=time.perf_counter() - start)
+        raise
+    finally:
+        prompt_affinity.reset(token)
+
+    # Ollama does not report token counts to the callback, estimate them instead
+    add_token_usage(calls=1,
+                    prompt_tokens=callback.prompt_tokens or estimate_tokens(prompt) + estimate_tokens(document_text),
+                    completion_tokens=callback.completion_tokens or estimate_tokens(answer),
+                    seconds=time.perf_counter() - start)
+    return answer
+
+
+# Run a question answering chain, answering from the response cache when the same prompt was asked before
+def run_chain(chain, prompt: str, document_text: str):
+    if not llm_cache_enabled:
+        return call_chain(chain, prompt, document_text)
+
+    cache = get_llm_cache()
+    key = llm_cache_key(chain, prompt, document_text)
+    answer = cache.get(key)
+    if answer is None:
+        answer = call_chain(chain, prompt, document_text)
+        cache.set(key, answer)
+    else:
+        add_token_usage(cached_calls=1)
+    return answer
+
+
+# Add to the batch totals and to the totals of the document being evaluated
+def add_token_usage(**counts):
+    usage = document_usage.get()
+    with token_usage_lock:
+        for totals in [token_usage_stats] if usage is None else [token_usage_stats, usage]:
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+
+
+# Start counting the LLM usage of a document (in the current thread or task and the ones it starts)
+def start_document_usage():
+    usage = {}
+    document_usage.set(usage)
+    return usage
+
+
+def token_usage_text(usage: dict):
+    return (f"{usage.get('calls', 0)} LLM calls ({usage.get('cached_calls', 0)} answered from the cache, "
+            f"{usage.get('failed_calls', 0)} failed, "
+            f"{usage.get('chunked_inputs', 0)} inputs split for the token budget), "
+            f"~{usage.get('prompt_tokens', 0)} prompt and ~{usage.get('completion_tokens', 0)} completion tokens, "
+            f"{usage.get('seconds', 0.0):.1f}s of LLM time, {usage.get('failed_criteria', 0)} criteria failed")
+
+
+# Print the LLM usage of the batch since the last report
+def report_token_usage_stats():
+    with token_usage_lock:
+        stats = dict(token_usage_stats)
+        token_usage_stats.clear()
+
+    if stats:
+        print(f"[INFO] Batch LLM usage: {token_usage_text(stats)}")
+        # Tokens are only counted for answered calls, time for every call
+        answered = stats.get("calls", 0) - stats.get("failed_calls", 0)
+        if stats.get("calls"):
+            print(f"[INFO] Per call: ~{stats.get('prompt_tokens', 0) // max(1, answered)} prompt tokens, "
+                  f"{stats['seconds'] / stats['calls']:.2f}s")
 
 
 # Load rubric from the YAML file
@@ -27,92 +192,214 @@ def load_rubric(filename: str):
     return rubric
 
 
-# Split the text by predefined parts (You can change the titles)
-def split_text_by_parts(text: str, output_dir: str):
+# Stands in for the input text while the static part of a prompt is rendered
+input_placeholder = "\x00INPUT_TEXT\x00"
+
+
+# Rubric parsed once, with the static text before and after the input pre-rendered for every prompt
+class CompiledRubric():
+    def __init__(self, path: str, layout: str = None) -> None:
+        self.path = path
+        self.layout = layout or prompt_layout
+        self.mtime = os.stat(path).st_mtime_ns
+        self.rubric = load_rubric(path)
+        self.sections = self.rubric.get("sections", {}) or {}
+        self.question_prompts = {}
+        self.section_prompts = {}
+        self.question_schemas = {}
+        self.section_schemas = {}
+
+        for part_name in self.sections:
+            criteria = self.criteria(part_name)
+            for question in criteria:
+                if self.layout == "prefix":
+                    rendered = generate_prefix_prompt(self.rubric, part_name, question, input_placeholder)
+                else:
+                    rendered = generate_prompt(self.rubric, part_name, question, input_placeholder)
+                self.question_prompts[(part_name, question["name"])] = tuple(rendered.split(input_placeholder, 1))
+                self.question_schemas[(part_name, question["name"])] = response_schema(part_name, [question])
+            if criteria:
+                rendered = generate_section_prompt(self.rubric, part_name, criteria, input_placeholder)
+                self.section_prompts[part_name] = tuple(rendered.split(input_placeholder, 1))
+                self.section_schemas[part_name] = response_schema(part_name, criteria)
+
+    def criteria(self, part_name: str):
+        return (self.sections.get(part_name) or {}).get("criteria", []) or []
+
+    # Same text as generate_prompt (or generate_prefix_prompt), with only the input substituted at call time
+    def render(self, part_name: str, question: dict, input_text: str):
+        prefix, suffix = self.question_prompts[(part_name, question["name"])]
+        return f"{prefix}{input_text}{suffix}"
+
+    # Same text as generate_section_prompt for all criteria of the section
+    def render_section(self, part_name: str, input_text: str):
+        prefix, suffix = self.section_prompts[part_name]
+        return f"{prefix}{input_text}{suffix}"
+
+
+# JSON schema of the answer expected for some criteria of a section
+def response_schema(part_name: str, criteria: list):
+    criterion_schema = {
+        "type": "object",
+        "properties": {"score": {"type": "integer", "enum": [0, 1]}, "explanation": {"type": "string"}},
+        "required": ["score", "explanation"]
+    }
+    names = [question["name"] for question in criteria]
+    return {
+        "type": "object",
+        "properties": {part_name: {"type": "object",
+                                   "properties": {name: criterion_schema for name in names},
+                                   "required": names}},
+        "required": [part_name]
+    }
+
+
+# Chain asking for the answer format selected by JSON_OUTPUT (the same chain when the mode is off)
+def output_chain(chain, rubric, part_name: str, question: dict = None):
+    if json_output_mode == "json":
+        return get_chain_variant(chain, format="json")
+    if json_output_mode == "schema":
+        if question is None:
+            return get_chain_variant(chain, format=rubric.section_schemas[part_name])
+        return get_chain_variant(chain, format=rubric.question_schemas[(part_name, question["name"])])
+    return chain
+
+
+compiled_rubrics = {}
+compiled_rubrics_lock = threading.Lock()
+
+
+# Compiled rubric for a file, recompiled whenever the file changes on disk (defaults to rubric_file)
+def get_compiled_rubric(path: str = None):
+    path = path or rubric_file
+    mtime = os.stat(path).st_mtime_ns
+
+    with compiled_rubrics_lock:
+        compiled = compiled_rubrics.get(path)
+        if compiled is None or compiled.mtime != mtime:
+            if compiled is not None:
+                print(f"[INFO] Rubric file changed, reloading: {path}")
+            compiled = CompiledRubric(path)
+            compiled_rubrics[path] = compiled
+    return compiled
+
+
+# Switch the rubric used for grading (e.g. Rubric_Scope.yaml) without restarting
+def use_rubric(path: str):
+    global rubric_file
+    if not os.path.exists(path) and os.path.exists(os.path.join("Prompts", path)):
+        path = os.path.join("Prompts", path)
+
+    get_compiled_rubric(path)
+    rubric_file = path
+    print(f"[INFO] Using rubric: {rubric_file}")
+
+
+# Body of a section: characters [start, end) of the document text, read only when its text is needed
+class SectionView():
+    __slots__ = ("source", "start", "end", "_text")
+
+    def __init__(self, source: str, start: int, end: int) -> None:
+        self.source = source
+        self.start = start
+        self.end = end
+        self._text = None
+
+    # Lines stripped of surrounding spaces, without leading or trailing blank lines
+    @property
+    def text(self):
+        if self._text is None:
+            lines = self.source[self.start:self.end].splitlines()
+            self._text = "\n".join(line.strip() for line in lines).strip()
+        return self._text
+
+
+# Find the parts of a document in one pass over its lines, as views into the text (You can change the titles)
+def find_sections(text: str):
+    line_starts = []
+    description_lines = []
+    section_lines = []
+
+    offset = 0
+    for i, line in enumerate(text.splitlines(keepends=True)):
+        line_starts.append(offset)
+        offset += len(line)
 
-    # Ensure the output directory exists
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        stripped_line = line.strip()
+        if description_matcher.search(stripped_line):
+            description_lines.append(i)
+        matched_title = section_title_matcher.search(stripped_line)
+        if matched_title:
+            section_lines.append((i, matched_title))
+    line_starts.append(offset)
 
-    chunks = {}
-    current_part = None
-    buffer = []
-    project_desc_indices = []
+    def view(first_line, end_line):
+        return SectionView(text, line_starts[first_line], line_starts[max(first_line, end_line)])
 
-    # Normalize text (strip leading/trailing spaces and replace newlines)
-    normalized_lines = [line.strip() for line in text.splitlines()]
+    sections = {}
+    line_count = len(line_starts) - 1
 
-    # Function to match part titles with flexible spaces
-    def match_title_with_variations(line, title):
-        regex_title = r'\s+'.join(re.escape(word) for word in title.split())
-        return re.search(fr"{regex_title}[\s:]*$", line, flags=re.IGNORECASE)
+    # Case 1: "Project Description / Purpose" exactly twice: the process milestone first, then the description
+    if len(description_lines) == 2:
+        first_start, second_start = description_lines
+        sections["Process Milestone"] = view(first_start + 1, second_start)
+        sections["Project Description"] = view(second_start + 1, line_count)
 
-    # Find positions for "Project Description / Purpose"
-    for i, line in enumerate(normalized_lines):
-        if match_title_with_variations(line, "Project Description / Purpose"):
-            project_desc_indices.append(i)
+    # Case 2: once or not at all: the same text, up to the next part title, for both parts
+    else:
+        start = description_lines[0] if description_lines else 0
+        end_index = next((i for i, _ in section_lines if i > start), line_count)
+        content = view(description_lines[0] + 1 if description_lines else 0, end_index)
+        sections["Process Milestone"] = content
+        sections["Project Description"] = content
 
-    # Case 1: Exactly 2 occurrences
-    if len(project_desc_indices) == 2:
-        first_start, second_start = project_desc_indices
-        chunks["Process Milestone"] = "\n".join(normalized_lines[first_start + 1: second_start]).strip()
-        chunks["Project Description"] = "\n".join(normalized_lines[second_start + 1:]).strip()
+    # Other parts run from their title to the next part title (a repeated title keeps its last occurrence)
+    for (i, title), (next_i, _) in zip(section_lines, section_lines[1:] + [(line_count, None)]):
+        sections[title] = view(i + 1, next_i)
 
-    # Case 2: 1 occurrence or none
-    else:
-        # Define the starting point
-        start = project_desc_indices[0] if project_desc_indices else 0
-
-        # Find the next part title after the last occurrence
-        next_title_index = None
-        for i in range(start + 1, len(normalized_lines)):
-            if any(match_title_with_variations(normalized_lines[i], title)
-                   for title in part_titles if title != "Project Description / Purpose"):
-                next_title_index = i
-                break
-
-        # If no next part title, go to the end
-        end_index = next_title_index if next_title_index else len(normalized_lines)
-
-        # Extract content from start to the next part title or end of document
-        content = "\n".join(normalized_lines[start + 1:end_index]).strip()
-
-        # If "Project Description / Purpose" exists, exclude the title line
-        if project_desc_indices:
-            content = "\n".join(normalized_lines[project_desc_indices[0] + 1:end_index]).strip()
-        else:
-            content = "\n".join(normalized_lines[:end_index]).strip()
-
-        # Save identical content for both parts
-        chunks["Process Milestone"] = content
-        chunks["Project Description"] = content
-
-    # General part splitting for other part_titles
-    for line in normalized_lines:
-        stripped_line = line.strip()
+    return sections
 
-        # Detect part titles
-        matched_title = next((title for title in part_titles 
-                              if title != "Project Description / Purpose" 
-                              and match_title_with_variations(stripped_line, title)), None)
 
-        if matched_title:
-            if current_part:
-                chunks[current_part] = "\n".join(buffer).strip()
-            current_part = matched_title
-            buffer = []
-        elif current_part:
-            buffer.append(line)
-
-    if current_part:
-        chunks[current_part] = "\n".join(buffer).strip()
-
-    # Save each part as a separate file
-    for part_name, content in chunks.items():
+# Split the text by predefined parts; the parts are only written to files when output_dir is given
+def split_text_by_parts(text: str, output_dir: str = None):
+    sections = find_sections(text)
+    dump_sections(sections, output_dir)
+    return {part_name: section.text for part_name, section in sections.items()}
+
+
+# Write each part to a file in output_dir (nothing without an output_dir)
+def dump_sections(sections: dict, output_dir: str = None):
+    if not output_dir:
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    for part_name, section in sections.items():
         with open(os.path.join(output_dir, f"{part_name.replace('/', '_')}.txt"), "w", encoding="utf-8") as f:
-            f.write(content)
+            f.write(section.text)
 
-    return chunks
+
+# Folder for the part files of one document (CHUNK_DUMPS=1), so documents graded in parallel never share one
+def chunk_dump_dir(text: str):
+    if not chunk_dumps:
+        return None
+    return os.path.join(output_dir, hashlib.sha256(text.encode("utf-8")).hexdigest()[:16])
+
+
+# Rough token count of a prompt (about four characters per token for English text)
+def estimate_tokens(text: str):
+    return (len(text) + 3) // 4
+
+
+# Examples of a criterion, as shown in the prompts
+def question_examples_text(question: dict):
+    examples_text = ""
+    example_keys = [key for key in question.keys() if key.startswith("example")]
+    for key in example_keys:
+        example = question[key]
+        examples_text += f"Example Input: {example['input']}\n"
+        examples_text += f"Score: {example['score']}\n"
+        examples_text += f"Explanation: {example['explanation']}\n\n"
+    return examples_text
 
 
 # Dynamically generate the prompt based on the loaded rubric
@@ -131,13 +418,7 @@ def generate_prompt(rubric: dict, part_name: str, question: dict, input_text: st
     question_text = f"{question['name']}"
 
     # Build examples dynamically
-    examples_text = ""
-    example_keys = [key for key in question.keys() if key.startswith("example")]
-    for key in example_keys:
-        example = question[key]
-        examples_text += f"Example Input: {example['input']}\n"
-        examples_text += f"Score: {example['score']}\n"
-        examples_text += f"Explanation: {example['explanation']}\n\n"
+    examples_text = question_examples_text(question)
 
     # Create the prompt template
     prompt_template = Template(f"""
@@ -172,76 +453,463 @@ def generate_prompt(rubric: dict, part_name: str, question: dict, input_text: st
     )
 
 
-def evaluate_question(text: str, rubric: dict, part_name: str, question: dict, chain):
-    prompt = generate_prompt(rubric, part_name, question, text)
-    document = Document(page_content=text)
+# Same content as generate_prompt, ordered so that every criterion of a section starts with the same text
+# (introduction, instructions, section input) and the model server can reuse its prompt cache between them
+def generate_prefix_prompt(rubric: dict, part_name: str, question: dict, input_text: str):
+    common_prompt = rubric.get("common_prompt", {})
+    introduction = common_prompt.get("introduction", "")
+    instructions = common_prompt.get("instructions", "")
+
+    question_text = f"{question['name']}"
+    extra_instructions = question.get("extra instructions", "").strip()
+    if extra_instructions:
+        question_text += f"\n\nAdditional Instructions:\n{extra_instructions}"
+
+    examples_text = question_examples_text(question)
+
+    return f"""
+    {introduction}
+
+    Instructions:
+    {instructions}
+
+    Evaluate the following input:
+    {input_text}
+
+    Evaluate the input above against this criterion:
+    {question_text}
+
+    {examples_text}
+
+    Respond only with JSON:
+    {{
+        "{part_name}": {{
+            "{question['name']}": {{"score": "", "explanation": ""}}
+        }}
+    }}
+    The score must either 0 or 1.
+    """
+
+
+def evaluate_question(text: str, rubric: CompiledRubric, part_name: str, question: dict, chain):
+    with span("evaluate_question", section=part_name, criterion=question["name"]):
+        if prescoring_enabled:
+            settled = prescore(question["name"], text)
+            if settled is not None:
+                return {part_name: {question["name"]: settled}}
+
+        key = llm_cache_key(chain, rubric.render(part_name, question, text), text)
+        result = deduplicated(key, evaluate_question_once, text, rubric, part_name, question, chain)
+        if result is None:
+            return failed_result(part_name, question["name"], "no answer from the LLM")
+        return result
+
+
+def evaluate_question_once(text: str, rubric: CompiledRubric, part_name: str, question: dict, chain):
+    max_input_tokens = input_token_budget(rubric, part_name, question)
+    if max_input_tokens and estimate_tokens(text) > max_input_tokens:
+        return evaluate_question_in_chunks(text, rubric, part_name, question, chain, max_input_tokens)
+
+    prompt = rubric.render(part_name, question, text)
+    chain = output_chain(chain, rubric, part_name, question)
 
     try:
-        with get_openai_callback() as callback:
-            answer = chain.run(input_documents=[document], question=prompt)
-            result = extract_and_parse_json(answer, part_name)
-            if not result:
-                return None
-            return result
+        answer = run_chain(chain, prompt, text)
+        result = extract_and_parse_json(answer, part_name, chain, question["name"])
+        if not result:
+            return failed_result(part_name, question["name"], "the answer of the LLM is not valid JSON")
+
+        criterion_data = criterion_answer(result, part_name, question["name"])
+        if criterion_data is None:
+            print(f"[WARNING] No score for '{question['name']}' in the answer for part '{part_name}': {result}")
+            return failed_result(part_name, question["name"], "the answer of the LLM has no score for the criterion")
+        return {part_name: {question["name"]: criterion_data}}
     except Exception as e:
         print(f"[ERROR] Evaluating question '{question['name']}' in part '{part_name}': {e}")
+        return failed_result(part_name, question["name"], f"{type(e).__name__}: {e}")
+
+
+# Score and explanation of a criterion in a parsed answer: under the part and criterion name, the only entry of
+# the part, or a bare {"score": ..., "explanation": ...} object. None for any other shape or an empty score
+def criterion_answer(result, part_name: str, question_name: str):
+    if not isinstance(result, dict):
+        return None
+
+    criterion_data = result
+    if "score" not in result:
+        part_result = result.get(part_name)
+        if not isinstance(part_result, dict):
+            return None
+        criterion_data = part_result
+        if "score" not in part_result:
+            criterion_data = part_result.get(question_name)
+            if criterion_data is None and len(part_result) == 1:
+                criterion_data = next(iter(part_result.values()))
+
+    return criterion_data if has_score(criterion_data) else None
+
+
+def has_score(criterion_data):
+    return isinstance(criterion_data, dict) and str(criterion_data.get("score", "")).strip() != ""
+
+
+# Result row of a criterion that could not be evaluated
+def failed_result(part_name: str, question_name: str, reason: str):
+    add_token_usage(failed_criteria=1)
+    return {part_name: {question_name: {"score": failed_score, "explanation": f"Evaluation failed: {reason}"}}}
+
+
+# Failed results of every criterion of the rubric, for a document whose whole evaluation failed
+def failed_document_results(reason: str, rubric_path: str = None):
+    rubric = get_compiled_rubric(rubric_path)
+    results = {}
+    for part_name in rubric.sections:
+        for question in rubric.criteria(part_name):
+            add_question_result(results.setdefault(part_name, {}), part_name,
+                                failed_result(part_name, question["name"], reason))
+    return results
+
+
+# True when a result (of a criterion, section or document) holds a failed criterion
+def contains_failure(result):
+    if not isinstance(result, dict):
+        return False
+    return result.get("score") == failed_score or any(contains_failure(value) for value in result.values())
+
+
+# Tokens left for the section input of a criterion prompt under TOKEN_BUDGET: None without a budget, 0 when
+# the prompt leaves less than min_chunk_tokens for the input (a criterion prompt is then sent unchunked, a
+# section batch prompt falls back to the criterion prompts). The input is sent twice: as the chain's context
+# and inside the prompt.
+def input_token_budget(rubric: CompiledRubric, part_name: str, question: dict = None):
+    if token_budget <= 0:
         return None
+    if question is None:
+        prompt_tokens = estimate_tokens(rubric.render_section(part_name, ""))
+    else:
+        prompt_tokens = estimate_tokens(rubric.render(part_name, question, ""))
+
+    max_input_tokens = (token_budget - prompt_tokens) // 2
+    if max_input_tokens < min_chunk_tokens:
+        prompt_name = f"'{part_name}' / '{question['name']}'" if question else f"the section batch of '{part_name}'"
+        with token_usage_lock:
+            first_warning = prompt_name not in budget_warnings
+            budget_warnings.add(prompt_name)
+        if first_warning:
+            fallback = "sending the input without chunking" if question else "asking the criteria one by one"
+            print(f"[WARNING] TOKEN_BUDGET={token_budget} is too small for the prompt of {prompt_name} "
+                  f"(~{prompt_tokens} tokens without the input, at least {2 * min_chunk_tokens} more needed "
+                  f"for the input); {fallback}")
+        return 0
+    return max_input_tokens
+
+
+# Split a section input into chunks of at most max_tokens estimated tokens, between lines where possible
+def split_for_budget(text: str, max_tokens: int):
+    max_chars = max_tokens * 4
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+# Merge rule for a criterion evaluated in chunks: the criterion is met (score 1) when any chunk meets it,
+# with the explanation of the first chunk that does; otherwise score 0 with the explanations of all chunks
+def merge_chunk_results(part_name: str, question_name: str, chunk_results: list):
+    answered = []
+    for index, result in enumerate(chunk_results):
+        criterion_data = criterion_answer(result, part_name, question_name)
+        if criterion_data is not None and criterion_data.get("score") != failed_score:
+            answered.append((index, criterion_data))
+
+    if not answered:
+        return failed_result(part_name, question_name, f"none of the {len(chunk_results)} parts of the input "
+                                                       f"could be evaluated")
+
+    for index, criterion_data in answered:
+        if str(criterion_data.get("score", "")).strip() == "1":
+            return {part_name: {question_name: {
+                "score": criterion_data["score"],
+                "explanation": f"{criterion_data.get('explanation', '')} "
+                               f"(input evaluated in {len(chunk_results)} parts, met in part {index + 1})"}}}
+
+    explanations = " | ".join(f"Part {index + 1}: {criterion_data.get('explanation', '')}"
+                              for index, criterion_data in answered)
+    return {part_name: {question_name: {"score": answered[0][1].get("score", 0), "explanation": explanations}}}
+
+
+# Evaluate a criterion on each chunk of an input that does not fit in the token budget
+def evaluate_question_in_chunks(text: str, rubric: CompiledRubric, part_name: str, question: dict, chain,
+                                max_input_tokens: int):
+    chunks = split_for_budget(text, max_input_tokens)
+    print(f"[INFO] Input of '{part_name}' (~{estimate_tokens(text)} tokens) is over the token budget, "
+          f"evaluating '{question['name']}' in {len(chunks)} parts")
+    add_token_usage(chunked_inputs=1)
+
+    chunk_results = [evaluate_question(chunk, rubric, part_name, question, chain) for chunk in chunks]
+    return merge_chunk_results(part_name, question["name"], chunk_results)
+
+
+# One prompt asking every criterion of a section, answered with a single combined JSON object
+def generate_section_prompt(rubric: dict, part_name: str, criteria: list, input_text: str):
+    common_prompt = rubric.get("common_prompt", {})
+    introduction = common_prompt.get("introduction", "")
+    instructions = common_prompt.get("instructions", "")
+
+    criteria_text = ""
+    for question in criteria:
+        criteria_text += f"{question['name']}\n"
+        extra_instructions = question.get("extra instructions", "").strip()
+        if extra_instructions:
+            criteria_text += f"Additional Instructions:\n{extra_instructions}\n"
+        criteria_text += f"\n{question_examples_text(question)}"
 
+    response_fields = ",\n".join(f'            "{question["name"]}": {{"score": "", "explanation": ""}}'
+                                  for question in criteria)
+
+    return f"""
+    {introduction}
+
+    Instructions:
+    {instructions}
+
+    Evaluate the input against each of the following criteria separately:
+
+    {criteria_text}
+    Evaluate the following input:
+    {input_text}
+
+    Respond only with JSON containing every criterion:
+    {{
+        "{part_name}": {{
+{response_fields}
+        }}
+    }}
+    Each score must either 0 or 1.
+    """
 
-def evaluate_section_by_questions(text: str, rubric: dict, part_name: str, chain, all_parts: dict):
-    section = rubric.get("sections", {}).get(part_name, {})
-    criteria = section.get("criteria", [])
 
+# Ask all criteria of a section at once, then ask the criteria missing from the answer one by one
+def evaluate_section_batch(text: str, rubric: CompiledRubric, part_name: str, criteria: list, chain):
+    prompt = rubric.render_section(part_name, text)
+
+    start = time.perf_counter()
+    batch_result = None
+    try:
+        batch_chain = output_chain(chain, rubric, part_name)
+        answer = run_chain(batch_chain, prompt, text)
+        batch_result = extract_and_parse_json(answer, part_name, batch_chain, "(section batch)")
+    except Exception as e:
+        print(f"[ERROR] Evaluating section batch for part '{part_name}': {e}")
+    batch_seconds = time.perf_counter() - start
+
+    # Criteria without a score under their own name in the answer are asked again alone
+    section_results = {}
+    answered = batch_result.get(part_name) if isinstance(batch_result, dict) else None
+    for question in criteria:
+        criterion_data = answered.get(question["name"]) if isinstance(answered, dict) else None
+        if has_score(criterion_data):
+            add_question_result(section_results, part_name, {part_name: {question["name"]: criterion_data}})
+
+    missing = [question for question in criteria if question["name"] not in section_results]
+    for question in missing:
+        print(f"[WARNING] '{question['name']}' missing from the section batch answer, asking it alone")
+        add_question_result(section_results, part_name, evaluate_question(text, rubric, part_name, question, chain))
+
+    # Compare with what asking every criterion separately would have sent
+    single_tokens = sum(estimate_tokens(rubric.render(part_name, question, text)) for question in criteria)
+    batch_tokens = estimate_tokens(prompt) + sum(estimate_tokens(rubric.render(part_name, question, text))
+                                                 for question in missing)
+    with section_batch_lock:
+        for name, value in [("sections", 1), ("criteria", len(criteria)), ("fallbacks", len(missing)),
+                            ("single_prompt_tokens", single_tokens), ("batch_prompt_tokens", batch_tokens),
+                            ("calls_saved", len(criteria) - 1 - len(missing)), ("batch_seconds", batch_seconds)]:
+            section_batch_stats[name] = section_batch_stats.get(name, 0) + value
+
+    # Keep the rubric order of the criteria
+    return {question["name"]: section_results[question["name"]]
+            for question in criteria if question["name"] in section_results}
+
+
+# Print what the section batch mode saved since the last report
+def report_section_batch_stats():
+    with section_batch_lock:
+        stats = dict(section_batch_stats)
+        section_batch_stats.clear()
+
+    if not stats.get("sections"):
+        return
+
+    saved_tokens = stats["single_prompt_tokens"] - stats["batch_prompt_tokens"]
+    print(f"[INFO] Section batch mode: {stats['sections']} sections, {stats['criteria']} criteria, "
+          f"{stats['fallbacks']} asked again alone")
+    print(f"[INFO] Prompt tokens: ~{stats['batch_prompt_tokens']} instead of ~{stats['single_prompt_tokens']} "
+          f"({saved_tokens / stats['single_prompt_tokens']:.0%} saved), {stats['calls_saved']} LLM round trips saved, "
+          f"~{stats['batch_seconds'] / stats['sections']:.1f}s per batched section "
+          f"(~{stats['calls_saved'] * stats['batch_seconds'] / stats['criteria']:.1f}s of round trips saved)")
+
+
+# Text sent for a section (Project Scope is evaluated together with the Project Description);
+# all_parts holds the SectionView of every part
+def section_input_text(text: str, part_name: str, all_parts: dict):
     # If Project Scope sectioin, add Project Description chunk
     if part_name == "Project Scope" and "Project Description" in all_parts:
-        combined_text = f"Project Description:\n{all_parts['Project Description']}\n\n" \
-                        f"{part_name}:\n{text}"
-    else:
-        combined_text = text
+        return f"Project Description:\n{all_parts['Project Description'].text}\n\n" \
+               f"{part_name}:\n{text}"
+    return text
+
+
+# Keep the score and explanation of every criterion answered for a section
+def add_question_result(section_results: dict, part_name: str, question_result: dict):
+    if not question_result:
+        return
+
+    for criterion_name, criterion_data in question_result.get(part_name, {}).items():
+        section_results[criterion_name] = {
+            "score": criterion_data.get("score", ""),
+            "explanation": criterion_data.get("explanation", "")
+        }
+
+
+# Evaluate the criteria of one section; the text of a section without criteria is never built
+def evaluate_section_by_questions(section: SectionView, rubric: CompiledRubric, part_name: str, chain,
+                                  all_parts: dict):
+    criteria = rubric.criteria(part_name)
+    if not criteria:
+        return {part_name: {}}
+
+    text = section.text
+    if not text.strip():
+        return {part_name: empty_section_results(criteria)}
+
+    combined_text = section_input_text(text, part_name, all_parts)
+
+    # Inputs over the token budget are asked criterion by criterion, in chunks
+    max_input_tokens = input_token_budget(rubric, part_name) if criteria else None
+    fits_budget = max_input_tokens is None or estimate_tokens(combined_text) <= max_input_tokens
+
+    if section_batch_mode and len(criteria) > 1 and fits_budget:
+        key = llm_cache_key(chain, rubric.render_section(part_name, combined_text), combined_text)
+        with span("evaluate_section_batch", section=part_name):
+            return {part_name: deduplicated(key, evaluate_section_batch, combined_text, rubric, part_name, criteria,
+                                            chain)}
 
     section_results = {}
     for question in criteria:
         question_result = evaluate_question(combined_text, rubric, part_name, question, chain)
-        if not question_result:
-            continue
-
-        for criterion_name, criterion_data in question_result.get(part_name, {}).items():
-            section_results[criterion_name] = {
-                "score": criterion_data.get("score", ""),
-                "explanation": criterion_data.get("explanation", "")
-            }
+        add_question_result(section_results, part_name, question_result)
 
     return {part_name: section_results}
 
-# Extract and Parsing JSON part from LLM response
-def extract_and_parse_json(llm_response: str, part_name: str):
-    # Extract JSON part from LLM response
-    json_match = re.search(r'\{.*\}', llm_response, re.DOTALL)
-    if not json_match:
-        print(f"[ERROR] No valid JSON found in LLM response for {part_name}: {llm_response}")
-        return fix_json_with_llm(llm_response, part_name)
-
-    json_data = json_match.group()
-
-    # Check bracket balance
-    if json_data.count('{') != json_data.count('}'):
-        print(f"[WARNING] Unbalanced brackets found in JSON for {part_name}. Attempting to fix...")
-        
-        # Auto-fix missing brackets
-        while json_data.count('{') > json_data.count('}'):
-            json_data += "}"
-        while json_data.count('}') > json_data.count('{'):
-            json_data = "{" + json_data
 
+# Run an evaluation once per fingerprint in the batch. Callers with a fingerprint already being evaluated
+# wait for that answer; failed evaluations (None or a failed criterion) are not kept, so a later duplicate
+# asks again
+def deduplicated(key: str, func, *args):
+    with dedup_lock:
+        future = evaluation_memo.get(key)
+        first = future is None
+        if first:
+            future = Future()
+            evaluation_memo[key] = future
+        outcome = "unique" if first else "duplicates"
+        dedup_stats[outcome] = dedup_stats.get(outcome, 0) + 1
+
+    if not first:
+        return copy.deepcopy(future.result())
+
+    result = None
     try:
-        result = json.loads(json_data)
+        result = func(*args)
+    finally:
+        future.set_result(result)
+        if result is None or contains_failure(result):
+            with dedup_lock:
+                evaluation_memo.pop(key, None)
+    return copy.deepcopy(result)
+
+
+# Deterministic result of the criteria of an empty section, without asking the LLM
+def empty_section_results(criteria: list):
+    with dedup_lock:
+        dedup_stats["empty"] = dedup_stats.get("empty", 0) + len(criteria)
+    return {question["name"]: {"score": 0, "explanation": empty_section_explanation} for question in criteria}
+
+
+# Print how many evaluations were shared or skipped, and forget the evaluations of the batch
+def report_dedup_stats():
+    with dedup_lock:
+        stats = dict(dedup_stats)
+        dedup_stats.clear()
+        evaluation_memo.clear()
+
+    if stats:
+        print(f"[INFO] Evaluation dedup: {stats.get('unique', 0)} unique evaluations, "
+              f"{stats.get('duplicates', 0)} duplicates answered from them, "
+              f"{stats.get('empty', 0)} criteria of empty sections scored without the LLM")
+
+
+# Count how an answer had to be parsed, per model and criterion
+def count_json_parse(chain, part_name: str, criterion: str, outcome: str):
+    model = getattr(chain.llm_chain.llm, "model", "unknown") if chain is not None else "unknown"
+    with json_parse_lock:
+        counts = json_parse_stats.setdefault((model, part_name, criterion), {})
+        counts["answers"] = counts.get("answers", 0) + 1
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+
+# Extract and Parsing JSON part from LLM response, asking the LLM to repair it only when local fixes fail
+def extract_and_parse_json(llm_response: str, part_name: str, chain=None, criterion: str = ""):
+    result, repaired = parse_llm_json(llm_response)
+    if result is not None:
+        if repaired:
+            print(f"[WARNING] Fixed malformed JSON locally for {part_name}")
+        count_json_parse(chain, part_name, criterion, "local_fixes" if repaired else "valid")
         return result
-    except json.JSONDecodeError as e:
-        print(f"[WARNING] JSON parsing failed: {e}")
-        print(f"[DEBUG] Attempting to fix JSON...")
 
-        # If parsing fails, try fixing with LLM
-        return fix_json_with_llm(json_data, part_name)      
+    print(f"[WARNING] JSON parsing failed for {part_name}: {llm_response}")
+    print(f"[DEBUG] Attempting to fix JSON...")
+    with span("json_repair", section=part_name, criterion=criterion):
+        result = fix_json_with_llm(llm_response, part_name)
+    count_json_parse(chain, part_name, criterion, "llm_repairs" if result is not None else "failures")
+    return result
+
+
+# Print how often answers needed a local fix or an LLM repair since the last report
+def report_json_parse_stats():
+    with json_parse_lock:
+        stats = dict(json_parse_stats)
+        json_parse_stats.clear()
+
+    models = {}
+    for (model, part_name, criterion), counts in stats.items():
+        totals = models.setdefault(model, {})
+        for name, value in counts.items():
+            totals[name] = totals.get(name, 0) + value
+
+    for model, totals in models.items():
+        answers = totals["answers"]
+        print(f"[INFO] JSON answers from {model} ({json_output_mode} output mode): {answers} answers, "
+              f"{totals.get('local_fixes', 0)} fixed locally, {totals.get('llm_repairs', 0)} repaired by the LLM "
+              f"({totals.get('llm_repairs', 0) / answers:.0%}), {totals.get('failures', 0)} unreadable")
+
+    for (model, part_name, criterion), counts in stats.items():
+        repairs = counts.get("llm_repairs", 0) + counts.get("failures", 0)
+        if repairs:
+            print(f"[INFO]   {model} / {part_name} / {criterion}: {repairs}/{counts['answers']} answers "
+                  f"needed an LLM repair")
 
 
 # Prompt LLM to fix borken JSON responses
@@ -249,8 +917,7 @@ def fix_json_with_llm(broken_response: str, part_name: str):
     print(f"[INFO] Attempting to fix JSON for part '{part_name}' using LLM...")
 
     try:
-        llm = ChatOllama(model="llama3")
-        chain = load_qa_chain(llm=llm)
+        chain = get_chain(llm_model, format="json") if json_output_mode != "off" else get_chain(llm_model)
 
         # Create a repair prompt for the LLM
         prompt = f"""
@@ -269,47 +936,138 @@ def fix_json_with_llm(broken_response: str, part_name: str):
         """
 
         # Run the chain with the repair prompt
-        document = [Document(page_content=broken_response)]
-        with get_openai_callback() as callback:
-            fixed_response = chain.run(input_documents=document, question=prompt)
+        fixed_response = run_chain(chain, prompt, broken_response)
 
         # Attempt to parse the fixed JSON
-        json_match = re.search(r'\{.*\}', fixed_response, re.DOTALL)
-        if not json_match:
+        fixed_json, _ = parse_llm_json(fixed_response)
+        if fixed_json is None:
             print(f"[ERROR] LLM did not return valid JSON for {part_name}: {fixed_response}")
-            return None
-
-        fixed_json = json_match.group()
-        return json.loads(fixed_json)
+        return fixed_json
 
     except Exception as e:
         print(f"[ERROR] Failed to fix JSON with LLM for {part_name}: {e}")
         return None
 
 
-def evaluate_document_with_prompt(text: str):
-    rubric = load_rubric(rubric_file)
-    parts = split_text_by_parts(text, output_dir)
+def evaluate_document_with_prompt(text: str, rubric_path: str = None):
+    rubric = get_compiled_rubric(rubric_path)
+    with span("find_sections"):
+        parts = find_sections(text)
+        dump_sections(parts, chunk_dump_dir(text))
 
     results = {}
-    llm = ChatOllama(model="llama3", temperature=0)
-    print(f"[DEBUG] Running model: {llm.model}")  # For debugging
-
-    chain = load_qa_chain(llm=llm)
+    usage = start_document_usage()
+    chain = get_chain(llm_model, temperature=0)
+    print(f"[DEBUG] Running model: {chain.llm_chain.llm.model}")  # For debugging
 
-    # for part_name, part_text in parts.items():
-    for file_name, part_text in parts.items():
+    # for part_name, section in parts.items():
+    for file_name, section in parts.items():
         part_name = file_name.replace(".txt", "")
 
         print(f"Evaluating part '{part_name}' by questions...")
 
-        part_result = evaluate_section_by_questions(part_text, rubric, part_name, chain, parts)
+        part_result = evaluate_section_by_questions(section, rubric, part_name, chain, parts)
         if part_result:
             results.update(part_result)
 
+    print(f"[INFO] Document LLM usage: {token_usage_text(usage)}")
     return process_results(results)
 
 
+# Give the running event loop a thread for every LLM call allowed at once (the default executor used by
+# asyncio.to_thread has min(32, cpu_count + 4) threads, which would cap LLM_CONCURRENCY on small machines)
+def use_llm_executor():
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(1, llm_concurrency),
+                                                                       thread_name_prefix="llm"))
+
+
+# Run a blocking LLM step in a worker thread once the shared concurrency limit allows it
+async def run_limited(semaphore, func, *args):
+    async with semaphore:
+        return await asyncio.to_thread(func, *args)
+
+
+async def evaluate_question_async(semaphore, text: str, rubric: CompiledRubric, part_name: str, question: dict, chain):
+    return await run_limited(semaphore, evaluate_question, text, rubric, part_name, question, chain)
+
+
+# Evaluate every criterion of a document concurrently and reassemble them like evaluate_document_with_prompt
+async def evaluate_document_with_prompt_async(text: str, semaphore=None, rubric_path: str = None):
+    if semaphore is None:
+        use_llm_executor()
+        semaphore = asyncio.Semaphore(llm_concurrency)
+
+    rubric = get_compiled_rubric(rubric_path)
+    with span("find_sections"):
+        parts = find_sections(text)
+        dump_sections(parts, chunk_dump_dir(text))
+
+    usage = start_document_usage()
+    chain = get_chain(llm_model, temperature=0)
+
+    # Section batch mode: one task per section, each asking all of its criteria in a single prompt.
+    # Prefix layout: one task per section too, so the criteria of a section reach the server back to back
+    # and reuse the prompt cache of the previous criterion
+    if section_batch_mode or prompt_layout == "prefix":
+        sections = await asyncio.gather(*(run_limited(semaphore, evaluate_section_by_questions, section, rubric,
+                                                      part_name, chain, parts)
+                                          for part_name, section in parts.items()))
+        results = {}
+        for section in sections:
+            results.update(section)
+        print(f"[INFO] Document LLM usage: {token_usage_text(usage)}")
+        return process_results(results)
+
+    calls = []
+    empty_parts = {}
+    for part_name, section in parts.items():
+        criteria = rubric.criteria(part_name)
+        if not criteria:
+            continue
+        part_text = section.text
+        if not part_text.strip():
+            empty_parts[part_name] = empty_section_results(criteria)
+            continue
+        combined_text = section_input_text(part_text, part_name, parts)
+        for question in criteria:
+            calls.append((part_name, question, combined_text))
+
+    answers = await asyncio.gather(*(evaluate_question_async(semaphore, combined_text, rubric, part_name,
+                                                             question, chain)
+                                     for part_name, question, combined_text in calls))
+
+    # gather keeps the call order, so sections and criteria come back in rubric order
+    results = {part_name: empty_parts.get(part_name, {}) for part_name in parts}
+    for (part_name, _, _), answer in zip(calls, answers):
+        add_question_result(results[part_name], part_name, answer)
+
+    print(f"[INFO] Document LLM usage: {token_usage_text(usage)}")
+    return process_results(results)
+
+
+# Await a document evaluation under a span labelled with the document name
+async def traced_document(document_name: str, evaluation):
+    with span("evaluate_document", document=document_name):
+        return await evaluation
+
+
+# Evaluate several documents at once under one global concurrency limit (None for a failed document)
+async def evaluate_documents_async(texts: list, rubric_path: str = None, names: list = None):
+    use_llm_executor()
+    semaphore = asyncio.Semaphore(llm_concurrency)
+    names = names or [None] * len(texts)
+    results = await asyncio.gather(*(traced_document(name, evaluate_document_with_prompt_async(text, semaphore,
+                                                                                             rubric_path))
+                                     for name, text in zip(names, texts)),
+                                   return_exceptions=True)
+
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f"[ERROR] Exception during LLM evaluation of document {i + 1}: {result}")
+            results[i] = None
+    return results
+
+
 # Process and aggregate results from different parts
 def process_results(results: dict):
     aggregated_result = {}
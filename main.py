@@ -1,13 +1,33 @@
 import os
-import pandas as pd
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 from Helper.logging import langsmith
-from file_processing import check_directory, read_pdf_text, convert_docx_to_pdf, process_pdf_with_combined_modes
-from llm_processing import evaluate_document_with_prompt, load_rubric, rubric_file
+from Helper.llm_pool import report_pool_stats
+from Helper.prescoring import report_prescoring_stats
+from Helper.tracing import span, traced_call, add_spans, report_trace
+from Helper.results_sink import ResultsSink
+from file_processing import check_directory, read_pdf_text, process_docx_with_combined_modes, \
+    process_pdf_with_combined_modes, get_extraction_cache, close_extraction_cache, get_extraction_report, \
+    read_docx_text, docx_reader, flush_debug_text
+from llm_processing import evaluate_document_with_prompt, get_compiled_rubric, llm_concurrency, \
+    evaluate_document_with_prompt_async, evaluate_documents_async, report_section_batch_stats, get_llm_cache, \
+    llm_cache_enabled, report_json_parse_stats, report_token_usage_stats, \
+    report_dedup_stats, failed_document_results
 
 # Load environment settings
 load_dotenv()
 
+# Number of worker processes used to extract documents (1 keeps the serial behaviour)
+extraction_workers = int(os.getenv("EXTRACTION_WORKERS", "1"))
+
+# With LLM_CONCURRENCY > 1, also evaluate different documents concurrently (waits for all extractions first)
+evaluate_across_documents = os.getenv("EVALUATE_ACROSS_DOCUMENTS", "0") == "1"
+
+# Result files written while grading: csv, parquet or both ("csv,parquet")
+results_formats = [result_format.strip() for result_format in os.getenv("RESULTS_FORMAT", "csv").split(",")]
+
 
 # Load and dynamically extract all sections from the rubric
 def extract_all_sections_from_rubric(rubric):
@@ -16,14 +36,162 @@ def extract_all_sections_from_rubric(rubric):
     return sections, section_names
 
 
+# Extract the text of a single uploaded document (runs inside a worker process)
+def extract_document(fileNameWithExtension: str):
+    # Extract file extension to differentiate between PDF and DOCX
+    target_fileName, extension = os.path.splitext(fileNameWithExtension)
+    extension = extension.lower()  # Normalize the extension to lowercase
+    input_file_path = os.path.join("Documents/NewlyUploaded", fileNameWithExtension)
+
+    # Read .pdf content
+    if extension == ".pdf":
+        print("Processing PDF file:", fileNameWithExtension)
+
+        # Step 1: Extract text from PDF
+        streamContent = read_pdf_text(input_file_path)
+        if not streamContent:
+            print(f"[ERROR] Failed to extract text from PDF: {fileNameWithExtension}")
+            return None
+
+        # Step 2: Process PDF using combined modes
+        fileContent = process_pdf_with_combined_modes(input_file_path, streamContent)
+        if not fileContent:
+            print(f"[ERROR] Failed to process PDF: {fileNameWithExtension}")
+            return None
+
+    # Read .docx content directly
+    elif extension == ".docx" and docx_reader == "native":
+        print("Processing docx file:", fileNameWithExtension)
+
+        fileContent = read_docx_text(input_file_path)
+        if not fileContent:
+            print(f"[ERROR] Failed to process DOCX: {fileNameWithExtension}")
+            return None
+
+    # Read .docx content through a PDF conversion
+    elif extension == ".docx":
+        print("Processing docx file:", fileNameWithExtension)
+
+        # Convert DOCX to PDF and process the converted PDF (cached on the DOCX, so the conversion
+        # only runs for new files)
+        fileContent = process_docx_with_combined_modes(input_file_path)
+        if not fileContent:
+            print(f"[ERROR] Failed to process DOCX: {fileNameWithExtension}")
+            return None
+
+    # Skip unsupported file formats
+    else:
+        print(f"[WARNING] Unsupported file format: {fileNameWithExtension}")
+        return None
+
+    # Debug artifacts are written in the background; make sure they land before the worker returns
+    flush_debug_text()
+
+    return target_fileName, fileContent, get_extraction_report(input_file_path)
+
+
+# Yield (file name, extraction result) in file order, extracting in a process pool when workers > 1
+def extract_documents(fileNamesWithExtension: list, workers: int):
+    if workers <= 1:
+        for fileNameWithExtension in fileNamesWithExtension:
+            try:
+                with span("extract_document", document=fileNameWithExtension):
+                    extracted = extract_document(fileNameWithExtension)
+            except Exception as e:
+                print(f"[ERROR] Exception during extraction for {fileNameWithExtension}: {e}")
+                extracted = None
+            yield fileNameWithExtension, extracted
+        return
+
+    print(f"[INFO] Extracting {len(fileNamesWithExtension)} files with {workers} worker processes")
+
+    # A worker that dies (e.g. a segfault in a PDF library) breaks the whole pool. The pool is then rebuilt
+    # for the unfinished files with a single worker, where the file being extracted when it dies again is
+    # the one that crashed it; that file is skipped and the rest continue with all workers
+    remaining = list(fileNamesWithExtension)
+    finished = {}
+    pool_workers = workers
+    while remaining:
+        broken_at = None
+        # The workers open their own cache connection instead of inheriting this one
+        close_extraction_cache()
+        with ProcessPoolExecutor(max_workers=pool_workers) as executor:
+            # Workers send their trace spans back with the extraction result
+            futures = {fileNameWithExtension: finished.pop(fileNameWithExtension, None) or
+                       executor.submit(traced_call, "extract_document", {"document": fileNameWithExtension},
+                                       extract_document, fileNameWithExtension)
+                       for fileNameWithExtension in remaining}
+
+            # Collect in submission order so the results table does not depend on completion order
+            for index, fileNameWithExtension in enumerate(remaining):
+                try:
+                    extracted, spans = futures[fileNameWithExtension].result()
+                    add_spans(spans)
+                except BrokenProcessPool:
+                    broken_at = index
+                    break
+                except Exception as e:
+                    print(f"[ERROR] Exception during extraction for {fileNameWithExtension}: {e}")
+                    extracted = None
+                yield fileNameWithExtension, extracted
+
+        if broken_at is None:
+            return
+
+        # Keep the files that were extracted before the pool broke
+        unfinished = remaining[broken_at:]
+        finished = {fileNameWithExtension: futures[fileNameWithExtension] for fileNameWithExtension in unfinished
+                    if futures[fileNameWithExtension].done()
+                    and not isinstance(futures[fileNameWithExtension].exception(), BrokenProcessPool)}
+
+        if pool_workers == 1:
+            print(f"[ERROR] A worker process crashed while extracting {unfinished[0]}, skipping the file")
+            yield unfinished[0], None
+            remaining = unfinished[1:]
+            pool_workers = workers
+        else:
+            print(f"[WARNING] A worker process crashed, extracting the {len(unfinished) - len(finished)} "
+                  f"unfinished files one at a time to find the file that caused it")
+            remaining = unfinished
+            pool_workers = 1
+
+
+# Yield (file name, extraction result, LLM results) for every extracted document, in file order
+def evaluate_documents(extracted_documents):
+    extracted_documents = ((name, extracted) for name, extracted in extracted_documents if extracted)
+
+    # All criteria of all documents share one concurrency limit
+    if evaluate_across_documents and llm_concurrency > 1:
+        documents = list(extracted_documents)
+        print(f"Calling evaluate_documents_async for {len(documents)} documents...")
+        evaluations = asyncio.run(evaluate_documents_async([extracted[1] for _, extracted in documents],
+                                                           names=[name for name, _ in documents]))
+        for (fileNameWithExtension, extracted), json_results in zip(documents, evaluations):
+            yield fileNameWithExtension, extracted, json_results
+        return
+
+    for fileNameWithExtension, extracted in extracted_documents:
+        print(f"Calling evaluate_document_with_prompt for {fileNameWithExtension}...")
+        try:
+            with span("evaluate_document", document=fileNameWithExtension):
+                if llm_concurrency > 1:
+                    json_results = asyncio.run(evaluate_document_with_prompt_async(extracted[1]))
+                else:
+                    json_results = evaluate_document_with_prompt(extracted[1])
+        except Exception as e:
+            print(f"[ERROR] Exception during LLM evaluation for {fileNameWithExtension}: {e}")
+            json_results = None
+        yield fileNameWithExtension, extracted, json_results
+
+
 # Main function to process PDF files and store the evaluation result
-def generate_grades():
+def generate_grades(workers: int = None):
     print("generate_grades function is called")
 
     check_directory()
 
-    # Load the rubric from YAML
-    rubric = load_rubric(rubric_file)
+    # Load the rubric from YAML (compiled once, reloaded when the file changes)
+    rubric = get_compiled_rubric().rubric
 
     # Dynamically extract all sections
     rubric_sections, section_names = extract_all_sections_from_rubric(rubric)
@@ -31,112 +199,95 @@ def generate_grades():
         print("[ERROR] No valid sections found in the rubric.")
         return
 
-    # Take the file list of each folder
-    fileNamesWithExtension = os.listdir("Documents/NewlyUploaded/")
+    # Take the file list of each folder (sorted so batches are reproducible)
+    fileNamesWithExtension = sorted(os.listdir("Documents/NewlyUploaded/"))
 
     # Initialize a set to track processed files
     processed_files = set()
+    backend_counts = {}
+    fallback_count = 0
+
+    # Result rows are written to disk as soon as each document is graded
+    results_sink = ResultsSink("Documents/Results/Result.csv", results_formats)
+
+    # Cache counters are shared with the worker processes through the cache file
+    cache_stats_before = get_extraction_cache().stats()
+    llm_cache_stats_before = get_llm_cache().stats() if llm_cache_enabled else None
 
-    # Initialize a global DataFrame for all results
-    all_results_df = pd.DataFrame(columns=["", "user_id", "AI_Grade", "Comment", "Section", "Criteria"])
+    # Extraction is CPU bound, so it runs in worker processes while the LLM evaluation below goes on
+    if workers is None:
+        workers = extraction_workers
 
     # Process documents to be graded
-    for fileNameWithExtension in fileNamesWithExtension:
-        fileContent = None
-        if fileNameWithExtension in processed_files:
-            continue
-
-        # Extract file extension to differentiate between PDF and DOCX
-        target_fileName, extension = os.path.splitext(fileNameWithExtension)
-        extension = extension.lower()  # Normalize the extension to lowercase
-        input_file_path = os.path.join("Documents/NewlyUploaded", fileNameWithExtension)
-
-        # Read .pdf content
-        if extension == ".pdf":
-            print("Processing PDF file:", fileNameWithExtension)
-            
-            # Step 1: Extract text from PDF
-            fileContent = read_pdf_text(input_file_path)
-            if not fileContent:
-                print(f"[ERROR] Failed to extract text from PDF: {fileNameWithExtension}")
+    extracted_documents = extract_documents(fileNamesWithExtension, workers)
+    try:
+        for fileNameWithExtension, extracted, json_results in evaluate_documents(extracted_documents):
+            if fileNameWithExtension in processed_files:
                 continue
 
-            # Step 2: Process PDF using combined modes
-            final_output = process_pdf_with_combined_modes(input_file_path)
-            if not final_output:
-                print(f"[ERROR] Failed to process PDF: {fileNameWithExtension}")
-                continue
+            target_fileName, fileContent, extraction_report = extracted
+            backend_counts[extraction_report["backend"]] = backend_counts.get(extraction_report["backend"], 0) + 1
+            if extraction_report["fallback"]:
+                fallback_count += 1
+                print(f"[INFO] {fileNameWithExtension} fell back to {extraction_report['backend']}: "
+                      f"{extraction_report['reason']}")
 
-        # Read .docx content
-        elif extension == ".docx":
-            print("Processing docx file:", fileNameWithExtension)
+            # Documents the LLM could not evaluate get a FAILED row per criterion instead of no rows
+            if not json_results:
+                print(f"[ERROR] No response from LLM for {fileNameWithExtension}.")
+                json_results = failed_document_results("no response from the LLM for the document")
 
-            # Convert DOCX to PDF and get the converted PDF path
-            fileContent, pdf_path = convert_docx_to_pdf(input_file_path)
-            if not fileContent or not pdf_path or not os.path.exists(pdf_path):
-                print(f"[ERROR] Failed to process DOCX: {fileNameWithExtension}")
-                continue
+            # One row per criterion of the current file
+            file_rows = []
+            idx = 0
+            for part_name, part_data in json_results.items():
+                for question, criterion_data in part_data.items():
+                    idx += 1
+                    file_rows.append({
+                        "": idx,
+                        "user_id": target_fileName,
+                        "AI_Grade": criterion_data.get("score", ""),
+                        "Comment": criterion_data.get("explanation", ""),
+                        "Section": part_name,
+                        "Criteria": question
+                    })
 
-            # Process the converted PDF
-            final_output = process_pdf_with_combined_modes(pdf_path)
-            if not final_output or not os.path.exists(final_output):
-                print(f"[ERROR] Failed to process converted PDF for DOCX: {fileNameWithExtension}")
-                continue
+            # Write the current file's results before grading the next one
+            with span("results_write", document=fileNameWithExtension):
+                results_sink.write_document(file_rows)
 
-        # Skip unsupported file formats
-        else:
-            print(f"[WARNING] Unsupported file format: {fileNameWithExtension}")
-            continue
+            # Mark the file as processed
+            processed_files.add(fileNameWithExtension)
+    finally:
+        results_sink.close()
+    print(f"All grades have been saved to {', '.join(results_sink.paths)}.")
 
-        # Validate file content before LLM evaluation
-        if not fileContent:
-            print(f"[ERROR] File content is empty for {fileNameWithExtension}. Skipping.")
-            continue
+    report_section_batch_stats()
+    report_json_parse_stats()
+    report_token_usage_stats()
+    report_dedup_stats()
+    report_prescoring_stats()
+    report_pool_stats()
+    report_trace()
 
-        # Read the final output file content
-        with open(final_output, "r", encoding='utf-8-sig') as final_file:
-            fileContent = final_file.read()
+    extracted_count = sum(backend_counts.values())
+    if extracted_count:
+        print(f"[INFO] Extraction backends: {backend_counts}, fallback rate: "
+              f"{fallback_count}/{extracted_count} ({fallback_count / extracted_count:.0%})")
 
-        # Evaluate the document using LLM
-        print(f"Calling evaluate_document_with_prompt for {fileNameWithExtension}...")
-        try:
-            json_results = evaluate_document_with_prompt(fileContent)
+    cache_stats = get_extraction_cache().stats()
+    hits = cache_stats["hits"] - cache_stats_before["hits"]
+    misses = cache_stats["misses"] - cache_stats_before["misses"]
+    print(f"[INFO] Extraction cache: {hits} hits, {misses} misses, "
+          f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024 / 1024:.1f} MB)")
 
-            if not json_results:
-                print("[ERROR] No response from LLM for {fileNameWithExtension}.")
-                continue
-        except Exception as e:
-            print(f"[ERROR] Exception during LLM evaluation for {fileNameWithExtension}: {e}")
-            continue
-
-        # Initialize a DataFrame for the current file
-        file_results_df = pd.DataFrame(columns=["", "user_id", "AI_Grade", "Comment", "Section", "Criteria"])
-
-        # Append the result to the DataFrame
-        idx = 0
-        for part_name, part_data in json_results.items():
-            for question, criterion_data in part_data.items():
-                idx += 1
-                new_entry = {
-                    "": idx,
-                    "user_id": target_fileName,
-                    "AI_Grade": criterion_data.get("score", ""),
-                    "Comment": criterion_data.get("explanation", ""),
-                    "Section": part_name,
-                    "Criteria": question
-                }
-                file_results_df = pd.concat([file_results_df, pd.DataFrame([new_entry])], ignore_index=True)
-
-        # Add the current file's results to the global DataFrame
-        all_results_df = pd.concat([all_results_df, file_results_df], ignore_index=True)
-
-        # Mark the file as processed
-        processed_files.add(fileNameWithExtension)
-
-    # Save the global results DataFrame to CSV
-    csv_file_name = "Documents/Results/Result.csv"
-    all_results_df.to_csv(csv_file_name, index=False, mode="w")  # Overwrite the file
-    print(f"All grades have been saved to {csv_file_name}.")
+    if llm_cache_enabled:
+        llm_cache_stats = get_llm_cache().stats()
+        hits = llm_cache_stats["hits"] - llm_cache_stats_before["hits"]
+        misses = llm_cache_stats["misses"] - llm_cache_stats_before["misses"]
+        hit_rate = hits / (hits + misses) if hits + misses else 0.0
+        print(f"[INFO] LLM response cache: {hits} hits, {misses} misses ({hit_rate:.0%} hit rate), "
+              f"{llm_cache_stats['entries']} entries ({llm_cache_stats['bytes'] / 1024 / 1024:.1f} MB)")
 
 
 if __name__ == "__main__":